@@ -1,11 +1,22 @@
-import os, sys
+import io, os, sys, time
 os.environ['PYGAME_HIDE_SUPPORT_PROMPT'] = "hide"
 
+# headless mode runs the simulation without a real screen (soak tests / profiling on CI boxes)
+HEADLESS  = os.environ.get('AZURE_HEADLESS') == '1' or '--headless' in sys.argv
+NO_ASSETS = os.environ.get('AZURE_NO_ASSETS') == '1' or '--no-assets' in sys.argv # blank stand-in images
+HEADLESS_SIZE = (1920, 1080)
+if HEADLESS:
+	os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+
 # importing all required modules and aliasing them
 import pygame, math
+import numpy as np
 import random as r
 from pygame import gfxdraw as gfx
 from datetime import datetime
+from functools import lru_cache
+import cProfile, hashlib, json, mmap, pickle, queue, struct, threading, zlib
+from collections import Counter
 from pathlib import Path
 
 
@@ -21,16 +32,60 @@ DARKER_GREY  = (0x20+10, 0x20+4, 0x20+8)
 BLUE         = (0x01, 0x21, 0x91)
 RED          = (0xff, 0x00, 0x00)
 
-# command line arg checks (currently disabled)
-arg = sys.argv[1] if len(sys.argv) > 1 else None
-match arg:
-	# case '-f': flags = pygame.NOFRAME
-	case _:    flags = pygame.NOFRAME | pygame.FULLSCREEN  # Default
-screen = pygame.display.set_mode(flags=flags, vsync=1)
+def option(name, default=None):
+	"""Value following a command line flag, or default"""
+	return sys.argv[sys.argv.index(name)+1] if name in sys.argv else default
+
+def resolution(text):
+	"""'1280x720' -> (1280, 720)"""
+	return tuple(int(n) for n in text.lower().split('x'))
+
+# display options: --windowed, --size WxH (the desktop's by default when fullscreen), --vsync on|off, and a canvas
+# drawn at --render-scale S (or --render-size WxH) of the display, upscaled by SDL (--upscale scaled) or by
+# the largest whole multiple that fits, centred (--upscale integer)
+WINDOWED = '--windowed' in sys.argv
+DISPLAY_SIZE = resolution(option('--size', '1280x720' if WINDOWED else '0x0')) # 0x0 is the desktop's
+VSYNC = option('--vsync', 'on') != 'off'
+RENDER_SCALE = float(option('--render-scale', 1))
+RENDER_SIZE = resolution(option('--render-size')) if '--render-size' in sys.argv else None
+UPSCALE = option('--upscale', 'scaled')
+if UPSCALE not in ('scaled', 'integer'): sys.exit(f"usage: --upscale scaled|integer (got {UPSCALE!r})")
+flags = 0 if WINDOWED else pygame.NOFRAME | pygame.FULLSCREEN
+# NOFRAME removes window border & controls, FULLSCREEN does fullscreen, SCALED lets SDL scale the canvas to the window
+
+upscaled = None # part of the display the canvas is scaled onto with --upscale integer
+if HEADLESS:
+	display = screen = pygame.display.set_mode(HEADLESS_SIZE)
+else:
+	pygame.display.init()
+	window_size = DISPLAY_SIZE if DISPLAY_SIZE != (0, 0) else pygame.display.get_desktop_sizes()[0]
+	canvas = RENDER_SIZE or (round(window_size[0]*RENDER_SCALE), round(window_size[1]*RENDER_SCALE))
+	if canvas == tuple(window_size):
+		display = screen = pygame.display.set_mode(DISPLAY_SIZE, flags, vsync=VSYNC)
+	elif UPSCALE == 'scaled':
+		display = screen = pygame.display.set_mode(canvas, flags | pygame.SCALED, vsync=VSYNC)
+	else:
+		display = pygame.display.set_mode(DISPLAY_SIZE, flags, vsync=VSYNC)
+		screen = pygame.Surface(canvas).convert()
+		factor = min(display.get_width()//canvas[0], display.get_height()//canvas[1]) or \
+			min(display.get_width()/canvas[0], display.get_height()/canvas[1]) # shrinks to fit a canvas bigger than the display
+		area = pygame.Rect(0, 0, int(canvas[0]*factor), int(canvas[1]*factor))
+		area.center = display.get_rect().center
+		upscaled = display.subsurface(area)
 WSX, WSY = screen.get_size()
-# NOFARME removes window border & controls, FULLSCREEN does fullscreen, SCALED makes sure the graphics scale with window size
 
-pygame.mouse.set_cursor(pygame.SYSTEM_CURSOR_CROSSHAIR)
+def present():
+	"""Shows the finished frame, scaling the canvas onto the display first if it has its own"""
+	if upscaled: pygame.transform.scale(screen, upscaled.get_size(), upscaled)
+	pygame.display.flip()
+
+def canvas_pos(pos):
+	"""Position on the display (the mouse) in canvas coordinates"""
+	if not upscaled: return pos
+	x, y = upscaled.get_abs_offset()
+	return ((pos[0]-x)*WSX/upscaled.get_width(), (pos[1]-y)*WSY/upscaled.get_height())
+
+if not HEADLESS: pygame.mouse.set_cursor(pygame.SYSTEM_CURSOR_CROSSHAIR)
 # fancy mouse
 
 #---------------------------------FONTS--------------------------------------------
@@ -40,26 +95,60 @@ pygame.font.init()
 font_path = Path("fonts") / "AlumniSansSC.ttf"
 ASfont = {size: pygame.font.Font(resource_path(font_path), size) for size in (20, 40, 60)}
 
-def textbox(font, string, rect_alignment, color=WHITE, alignment='center'):
-	"""Write text on the screen at a given co-ordinates"""
-	text = font.render(string, True, color)
+@lru_cache(maxsize=256)
+def render_text(font, string, color, antialias=True):
+	"""Rendered text surfaces, the least recently used ones get dropped once 256 are cached"""
+	return font.render(string, antialias, color)
+
+@lru_cache(maxsize=32)
+def render_number(font, string, color, antialias=True):
+	"""Separate small cache for the HUD numbers (score, fps, ammo) so their churn never evicts menu text"""
+	return font.render(string, antialias, color)
+
+NUMERIC_CHARS = set('0123456789/')
+
+def textbox(font, string, rect_alignment, color=WHITE, alignment='center', surface=None, cached=True):
+	"""Write text on the screen (or another surface) at a given co-ordinates, cached=False for one-off strings"""
+	if not cached: text = font.render(string, True, color)
+	else: text = (render_number if set(string) <= NUMERIC_CHARS else render_text)(font, string, tuple(color))
 	rect = text.get_rect()
 	setattr(rect, alignment, rect_alignment)
-	screen.blit(text, rect)
+	(screen if surface is None else surface).blit(text, rect)
 
-textbox(ASfont[60], "Loading assets...", [WSX/2, WSY/2])
-pygame.display.flip()
 #---------------------------------IMAGES------------------------------------------
 
 # importing the background image which will be looped later
 background_path = Path("assets") / "background_tile.png"
-background_tile = pygame.transform.smoothscale_by(pygame.image.load(resource_path(str(background_path))).convert_alpha(), 0.32)
 bg_length = int(250*.32)
 
+class Background:
+	# the tiled floor and its darkening overlay baked into one surface a tile bigger than the screen
+	def __init__(self, length):
+		self.length = length
+		self.size = None
+		self.surface = None
+
+	def bake(self):
+		self.size = screen.get_size()
+		self.surface = pygame.Surface((self.size[0]+self.length, self.size[1]+self.length)).convert()
+		self.surface.fill(DARKEST_GREY)
+		for x in range(0, self.surface.get_width(), self.length):
+			for y in range(0, self.surface.get_height(), self.length):
+				self.surface.blit(images['background_tile'], (x, y))
+		gfx.box(self.surface, self.surface.get_rect(), (0, 0, 0, 100))
+		self.flat = self.surface.get_at((0, 0)) # the darkened floor colour, for drawing without tiles
+
+	def render(self, offset, tiles=True):
+		"""Scrolls the baked layer by the global offset with a single blit, rebaking if the screen size changed"""
+		if self.size != screen.get_size(): self.bake()
+		if not tiles: return screen.fill(self.flat)
+		screen.blit(self.surface, (int(offset[0]%self.length) - self.length, int(offset[1]%self.length) - self.length))
+
 def load_scaled_image(base_path, subpath, scale=1.0, flip_left=False):
-	"""load an image, scale it, and optionally flip it"""
+	"""load an image, scale it, and optionally flip it (left in its file's pixel format, see AssetManager.take())"""
+	if NO_ASSETS: return pygame.Surface((32, 32), pygame.SRCALPHA)
 	full_path = resource_path(str(Path(base_path) / subpath))
-	img = pygame.image.load(full_path).convert_alpha()
+	img = pygame.image.load(full_path)
 	scaled_img = pygame.transform.scale_by(img, scale)
 	return pygame.transform.flip(scaled_img, flip_left, False) if flip_left else scaled_img
 
@@ -75,27 +164,15 @@ IMAGE_CONFIGS = {
 	"enemy_basic_r":           {"path": "assets/enemies/basic.png",           "scale": 0.3},
 	"enemy_shooter_r":         {"path": "assets/enemies/shooter.png",         "scale": 0.225},
 	"enemy_exploder_r":        {"path": "assets/enemies/exploder.png",        "scale": 0.3},
-	"enemy_exploder_primed_r": {"path": "assets/enemies/exploder_primed.png", "scale": 0.3},
-	"boss_r":                  {"path": "assets/enemies/boss.png",            "scale": 0.45},
-	"boss_primed_r":           {"path": "assets/enemies/boss_primed.png",     "scale": 0.45},
+	"enemy_exploder_primed_r": {"path": "assets/enemies/exploder_primed.png", "scale": 0.3, "alpha": 0},
+	"boss_r":                  {"path": "assets/enemies/boss.png",            "scale": 0.45, "group": "boss"},
+	"boss_primed_r":           {"path": "assets/enemies/boss_primed.png",     "scale": 0.45, "group": "boss"},
 }
 
-images = {}
-# loading the images
-for name, config in IMAGE_CONFIGS.items():
-	images[name] = load_scaled_image("", config["path"], config["scale"])
-	
-	# auto-generate left-facing variants (for enemies)
-	if name.endswith("_r"):
-		left_name = name.replace("_r", "_l")
-		images[left_name] = load_scaled_image("", config["path"], config["scale"], flip_left=True)
-
-images['enemy_exploder_primed_r'].set_alpha(0)
-images['enemy_exploder_primed_l'].set_alpha(0)
-
 # player image loader
 def player_loader(path):
-	return pygame.transform.scale_by(pygame.image.load(resource_path(path)).convert_alpha(),1.75)
+	if NO_ASSETS: return pygame.Surface((64, 80), pygame.SRCALPHA)
+	return pygame.transform.scale_by(pygame.image.load(resource_path(path)),1.75)
 
 # configuration for all player animations
 PLAYER_ANIMATIONS = {
@@ -117,28 +194,211 @@ PLAYER_ANIMATIONS = {
 	}
 }
 
-# load all animations dynamically
-images_player = {
-	anim_type: {
-		direction: [player_loader(f"assets/sprites/{template.format(x=x)}")
-			for x in range(8)
-		]
-		for direction, template in directions.items()
-	}
-	for anim_type, directions in PLAYER_ANIMATIONS.items()
-}
+#--------------------------------ASSET-PACK----------------------------------------
+
+# every image already scaled (and flipped) as raw RGBA in one file, built with `python azure.py --build-pack`
+ASSET_PACK = Path("assets") / "assets.pack"
+# bumped whenever the names or layout in the pack change, older packs are then ignored
+# 1 first packs, 2 the background tile named images/background_tile
+PACK_FORMAT = 2
+PACK_MAGIC = b'AZPK%d' % PACK_FORMAT
+
+def asset_sources():
+	"""Every image file the game loads"""
+	sources = [str(background_path)] + [config["path"] for config in IMAGE_CONFIGS.values()]
+	for directions in PLAYER_ANIMATIONS.values():
+		for template in directions.values():
+			sources += [f"assets/sprites/{template.format(x=x)}" for x in range(8)]
+	return sources
+
+def pack_signature():
+	"""Changes whenever a source image's contents or the scaling config change, so stale packs get ignored
+	(hashing contents rather than modification times keeps a pack valid across checkouts and copies)"""
+	signature = hashlib.sha1(repr((IMAGE_CONFIGS, PLAYER_ANIMATIONS, bg_length)).encode())
+	for source in asset_sources():
+		signature.update(source.encode())
+		signature.update(Path(resource_path(source)).read_bytes())
+	return signature.hexdigest()
+
+def load_asset_pack():
+	"""Reads the pack's index and maps its pixels without touching them, returns {name: (pixels, size)},
+	or {} if it's missing or stale; each image is only read when its loading job asks for it"""
+	try:
+		with open(resource_path(ASSET_PACK), 'rb') as file:
+			start = len(PACK_MAGIC)+4
+			head = file.read(start)
+			if head[:len(PACK_MAGIC)] != PACK_MAGIC: return {}
+			header_length = int.from_bytes(head[len(PACK_MAGIC):], 'little')
+			header = json.loads(file.read(header_length))
+			if header['signature'] != pack_signature(): return {}
+			data = memoryview(mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ))
+	except (OSError, ValueError, KeyError):
+		return {}
+
+	pixels = start + header_length
+	return {name: (data[pixels+offset:pixels+offset+w*h*4], (w, h)) for name, (offset, w, h) in header['index'].items()}
+
+def build_asset_pack():
+	"""Writes every loaded image into the pack, with an index of where each one's pixels start"""
+	assets.require()
+	surfaces = {f"images/{name}": image for name, image in images.items()}
+	for anim_type, directions in images_player.items():
+		for direction, frames in directions.items():
+			for x, frame in enumerate(frames):
+				surfaces[f"player/{anim_type}/{direction}/{x}"] = frame
+
+	index, blobs, offset = {}, [], 0
+	for name, surface in surfaces.items():
+		blob = pygame.image.tobytes(surface, 'RGBA')
+		index[name] = (offset, *surface.get_size())
+		blobs.append(blob)
+		offset += len(blob)
+
+	header = json.dumps({'signature': pack_signature(), 'index': index}).encode()
+	with open(resource_path(ASSET_PACK), 'wb') as file:
+		file.write(PACK_MAGIC + len(header).to_bytes(4, 'little') + header)
+		for blob in blobs: file.write(blob)
+	return len(surfaces)
+
+packed = {} if NO_ASSETS or '--build-pack' in sys.argv else load_asset_pack()
+
+def packed_or(name, load):
+	"""The surface from the asset pack when there is one, otherwise loads it the slow way"""
+	return pygame.image.frombuffer(*packed[name], 'RGBA') if name in packed else load()
+
+#--------------------------------LOADING-------------------------------------------
+
+class AssetManager:
+	# loads the images on a worker thread in priority order and tracks which are ready,
+	# the main thread can require a group to load whatever it still needs right away
+	def __init__(self):
+		self.jobs = {} # name -> (group, load), load returns {pack name: surface}
+		self.done = {} # name -> event set once loaded
+		self.loaded = {} # name -> the surfaces of a finished job, until the main thread takes them
+		self.errors = {}
+		self.claimed = set()
+		self.lock = threading.Lock()
+
+	def add(self, name, group, load):
+		self.jobs[name] = (group, load)
+		self.done[name] = threading.Event()
+
+	def start(self):
+		threading.Thread(target=self.work, daemon=True).start()
+
+	def claim(self, name):
+		"""Claims a job so only one thread ever runs it"""
+		with self.lock:
+			if name in self.claimed: return False
+			self.claimed.add(name)
+			return True
+
+	def run(self, name):
+		try: self.loaded[name] = self.jobs[name][1]()
+		except Exception as error: self.errors[name] = error # re-raised on the main thread by take()
+		self.done[name].set()
+
+	def take(self, name):
+		"""Main thread: converts a loaded job's surfaces to the display format (SDL doesn't promise that's
+		safe from another thread) and files them where the game looks them up, by their pack names"""
+		if name in self.errors: raise self.errors[name]
+		for key, surface in self.loaded.pop(name, {}).items():
+			kind, *path = key.split('/')
+			if kind == 'images': images[path[0]] = surface.convert_alpha()
+			else: images_player[path[0]].setdefault(path[1], [None]*8)[int(path[2])] = surface.convert_alpha()
+
+	def work(self):
+		for group in ('play', 'boss'):
+			for name, (job_group, load) in self.jobs.items():
+				if job_group == group and self.claim(name): self.run(name)
+
+	def ready(self, name):
+		return self.done[name].is_set()
+
+	def progress(self):
+		return sum(done.is_set() for done in self.done.values())/len(self.done)
+
+	def require(self, group=None):
+		"""Returns once every asset of the group (or every asset) is loaded, loading any not yet started here"""
+		for name, (job_group, load) in self.jobs.items():
+			if group not in (None, job_group): continue
+			if self.claim(name): self.run(name)
+			else: self.done[name].wait()
+			self.take(name)
+
+images = {}
+images_player = {anim_type: {} for anim_type in PLAYER_ANIMATIONS}
+assets = AssetManager()
+
+# the loaders run on the worker thread and return their surfaces unconverted, by pack name
+
+def load_background_tile():
+	if NO_ASSETS: return {'images/background_tile': pygame.Surface((bg_length, bg_length), pygame.SRCALPHA)}
+	return {'images/background_tile': packed_or('images/background_tile', lambda : pygame.transform.smoothscale_by(
+		pygame.image.load(resource_path(str(background_path))), 0.32))}
+
+def image_loader(name, config):
+	def load():
+		image = packed_or(f"images/{name}", lambda : load_scaled_image("", config["path"], config["scale"]))
+		loaded = {f"images/{name}": image}
+		# auto-generate left-facing variants (for enemies)
+		if name.endswith("_r"):
+			left_name = f"images/{name.replace('_r', '_l')}"
+			loaded[left_name] = packed_or(left_name, lambda : pygame.transform.flip(image, True, False))
+		if "alpha" in config:
+			for surface in loaded.values(): surface.set_alpha(config["alpha"])
+		return loaded
+	return load
+
+def animation_loader(anim_type, direction, template):
+	def load():
+		return {f"player/{anim_type}/{direction}/{x}": packed_or(f"player/{anim_type}/{direction}/{x}",
+				lambda : player_loader(f"assets/sprites/{template.format(x=x)}"))
+			for x in range(8)}
+	return load
+
+# queued in the order they're needed: the start screen only uses fonts, the first wave
+# needs everything but the boss, which only shows up two minutes in
+assets.add('background_tile', 'play', load_background_tile)
+for name, config in IMAGE_CONFIGS.items():
+	assets.add(name, config.get("group", 'play'), image_loader(name, config))
+for anim_type, directions in PLAYER_ANIMATIONS.items():
+	for direction, template in directions.items():
+		assets.add(f"player/{anim_type}/{direction}", 'play', animation_loader(anim_type, direction, template))
+assets.start()
+
+background = Background(bg_length)
 
 #------------------------------GLOBALS---------------------------------------------
 
 # global variables
+# the simulation always steps at TICK_RATE, drawing runs as fast as MAX_FPS allows and
+# interpolates between the last two ticks by render_alpha (0-1)
+TICK_RATE = 60
+MAX_TICKS_PER_FRAME = 5 # after a long stall the game slows down instead of spiralling
+MAX_FPS = 240
+if '--fps' in sys.argv: MAX_FPS = 0 if option('--fps') == 'uncapped' else int(option('--fps'))
+render_alpha = 1
+
+# time warp runs time_warp ticks per drawn frame, WARP_MAX as many as fit in WARP_FRAME_BUDGET seconds
+WARP_MAX = 0
+WARP_STEPS = (1, 2, 4, 8, 16, 32, WARP_MAX) # cycled with [F]
+WARP_FRAME_BUDGET = 1/30
+time_warp = 1
+if '--warp' in sys.argv:
+	warp_arg = sys.argv[sys.argv.index('--warp')+1]
+	time_warp = WARP_MAX if warp_arg == 'max' else int(warp_arg)
+
 player_speed = 2
 enemy_shoot_cooldown = 300
 
+# everything lives in world coordinates, the screen shows the WSX by WSY area whose top left is the camera;
+# global_dx/dy is how far the view scrolls this tick (the opposite of the player's movement)
 global_dx = 0
 global_dy = 0
-global_offset = [0, 0]
+camera = [0, 0]
+draw_camera = (0, 0) # camera of the frame being drawn, between its last two ticks
 
-projectile_speed = 10
 player_projectile_speed = 15
 enemy_projectile_speed = 3
 
@@ -147,9 +407,10 @@ enemy_speed = 1.2
 mouse_left_held = False
 mouse_right_click = False
 
-player_projectiles = []
-enemy_projectiles = []
-adversaries = []
+# bullet owners in the projectile store
+PLAYER_OWNED = 0
+ENEMY_OWNED = 1
+
 explosions = []
 active_boss = None
 boss_max_health = 1000
@@ -164,6 +425,21 @@ score = 0
 
 reloadtrig = False
 
+# gameplay randomness comes from separate seeded streams, so one system drawing more numbers (e.g. the player
+# firing) never shifts another's (the spawns), and a seed plus the inputs replays a whole run
+SEED = int(sys.argv[sys.argv.index('--seed')+1]) if '--seed' in sys.argv else None
+rng_spawn    = r.Random() # spawn rolls and positions, boss minions
+rng_combat   = r.Random() # bullet spread
+rng_upgrades = r.Random() # upgrade choices
+RNG_STREAMS = {'spawn': rng_spawn, 'combat': rng_combat, 'upgrades': rng_upgrades}
+session_seed = None
+
+def seed_rngs(seed=None):
+	"""Seeds every stream from one session seed (a new random one when None)"""
+	global session_seed
+	session_seed = r.randrange(2**32) if seed is None else seed
+	for name, stream in RNG_STREAMS.items(): stream.seed(f"{session_seed}/{name}")
+
 #-----------------------------FUNCS------------------------------------------------
 
 def clamp(n, minn, maxn):
@@ -176,6 +452,172 @@ def vector_converter(num, angle):
 	"""Returns a list with x & y offset from a vector quantity"""
 	return [num*math.cos(angle), num*math.sin(angle)]
 
+#-----------------------------SPATIAL-GRID-----------------------------------------
+
+class SpatialGrid:
+	# uniform grid of buckets so neighbour lookups only look at nearby cells
+	def __init__(self, cell_size):
+		self.cell_size = cell_size
+		self.cells = {}
+
+	def rebuild(self, objects, key=lambda obj : obj.rect):
+		"""Buckets every object by the cell its centre is in"""
+		self.cells = {}
+		size = self.cell_size
+		for obj in objects:
+			centre = key(obj).center
+			cell = (centre[0]//size, centre[1]//size)
+			if cell in self.cells: self.cells[cell].append(obj)
+			else: self.cells[cell] = [obj]
+
+	def query(self, rect):
+		"""Returns the objects whose centre cell is within half a cell of the rect"""
+		size = self.cell_size
+		margin = size//2
+		nearby = []
+		for x in range((rect.left-margin)//size, (rect.right+margin)//size + 1):
+			for y in range((rect.top-margin)//size, (rect.bottom+margin)//size + 1):
+				if (x, y) in self.cells: nearby.extend(self.cells[(x, y)])
+		return nearby
+
+# rebuilt once per tick, half a cell is wider than half an enemy plus a tick of movement
+enemy_grid = SpatialGrid(48)
+
+# a bullet's corners are within 6 px of its centre and an enemy's edges within 11 px of its own (the boss is
+# checked apart), so every enemy a bullet can touch is centred in the 3x3 grid cells around the bullet's
+CELL_KEY = 1 << 20 # grid cell (x, y) -> x*CELL_KEY + y, one number to sort and search
+NEIGHBOUR_KEYS = np.array([dx*CELL_KEY + dy for dx in (-1, 0, 1) for dy in (-1, 0, 1)])
+
+def resolve_projectile_hits():
+	"""One collision pass between the player bullets and every enemy, hits are queued on the enemy
+
+	Every (bullet, nearby enemy) pair is tested at once; a bullet hits the first enemy in grid order
+	(cells by x then y, enemies in spawn order, the boss last) that holds one of its hitbox corners
+	"""
+	idx = projectiles.live(PLAYER_OWNED)
+	targets = adversaries.live + [active_boss] if active_boss else adversaries.live
+	if not len(idx) or not targets: return
+	size = enemy_grid.cell_size
+	n = len(adversaries)
+
+	# broadphase: enemies sorted by grid cell, each bullet looks up the ranges of its 9 neighbouring cells
+	rects = np.array([(enemy.rect.left, enemy.rect.top, enemy.rect.right, enemy.rect.bottom) for enemy in targets])
+	centres = (rects[:n, :2] + rects[:n, 2:]) // 2 # the same rounding as Rect.center
+	keys = centres[:, 0]//size*CELL_KEY + centres[:, 1]//size
+	order = np.argsort(keys, kind='stable')
+	keys = keys[order]
+	cells = np.floor(projectiles.pos[idx]/size).astype(int)
+	lookups = (cells[:, 0]*CELL_KEY + cells[:, 1])[:, None] + NEIGHBOUR_KEYS
+	starts, ends = np.searchsorted(keys, lookups, 'left').ravel(), np.searchsorted(keys, lookups, 'right').ravel()
+	counts = ends-starts
+	total = counts.sum()
+	bullets = np.repeat(np.repeat(np.arange(len(idx)), len(NEIGHBOUR_KEYS)), counts)
+	enemies = order[np.repeat(starts, counts) + np.arange(total) - np.repeat(np.cumsum(counts)-counts, counts)]
+	if active_boss:
+		bullets = np.concatenate((bullets, np.arange(len(idx))))
+		enemies = np.concatenate((enemies, np.full(len(idx), n)))
+		pairs = np.argsort(bullets, kind='stable') # the boss after each bullet's enemies
+		bullets, enemies = bullets[pairs], enemies[pairs]
+	if not len(bullets): return
+
+	# narrowphase: the corners truncated to whole pixels like Rect.collidepoint, inside the enemy's rect
+	corners = np.trunc(projectiles.hitbox_corners(idx)[bullets])
+	rect = rects[enemies][:, None, :]
+	inside = ((corners[..., 0] >= rect[..., 0]) & (corners[..., 0] < rect[..., 2]) &
+		(corners[..., 1] >= rect[..., 1]) & (corners[..., 1] < rect[..., 3])).any(axis=1)
+	bullets, enemies = bullets[inside], enemies[inside]
+	first = np.flatnonzero(np.diff(bullets, prepend=-1)) # pairs are in bullet order, keep each one's first hit
+	for bullet, enemy in zip(bullets[first].tolist(), enemies[first].tolist()):
+		i = int(idx[bullet])
+		targets[enemy].hits.append((float(projectiles.damage[i]), projectiles.knockback[i].tolist()))
+		projectiles.kill(i)
+
+#-----------------------------ENTITY-POOL------------------------------------------
+
+class EntityPool:
+	# the live entities in order, plus free lists of dead ones (per class) waiting to be reused
+	def __init__(self):
+		self.live = []
+		self.free = {}
+		self.next_id = 0 # ids tell the entities apart for scheduling, counting up over the run
+
+	def __iter__(self):
+		return iter(self.live)
+
+	def __len__(self):
+		return len(self.live)
+
+	def __getitem__(self, i):
+		return self.live[i]
+
+	def __getstate__(self): # the free lists are only a cache
+		return {'live': self.live, 'free': {}, 'next_id': self.next_id}
+
+	def spawn(self, cls, *args):
+		"""Recycles a dead entity of the class when there is one, otherwise makes a new one"""
+		free = self.free.get(cls)
+		if free:
+			entity = free.pop()
+			entity.spawn(*args)
+		else:
+			entity = cls(*args)
+		entity.uid = self.next_id
+		self.next_id += 1
+		self.live.append(entity)
+		return entity
+
+	def sweep(self):
+		"""Compacts out every entity flagged for deletion in one pass, keeping them for reuse"""
+		kept = 0
+		for entity in self.live:
+			if entity.delete:
+				self.free.setdefault(type(entity), []).append(entity)
+			else:
+				self.live[kept] = entity
+				kept += 1
+		del self.live[kept:]
+
+	def clear(self):
+		for entity in self.live: entity.delete = True
+		self.sweep()
+
+#-----------------------------LEVEL-OF-DETAIL--------------------------------------
+
+# enemies far off screen think less often and catch up on the ticks they skipped when they do;
+# (margin around the screen, ticks between updates) from the closest band out, LOD_FAR past the last
+LOD_BANDS = ((120, 1), (600, 2), (1500, 4))
+LOD_FAR = 8
+lod = '--no-lod' not in sys.argv # part of the world, since it changes how a run plays out
+
+def update_enemies():
+	"""Updates the enemies due this tick, staggered by id so every band costs about the same each tick"""
+	tick = round(level_time*TICK_RATE)
+	mid_x, mid_y = camera[0]+WSX/2, camera[1]+WSY/2
+	for enemy in adversaries:
+		for explosion in explosions:
+			if math.sqrt((explosion[0]-enemy.rect.center[0])**2+(explosion[1]-enemy.rect.center[1])**2)<=explosion[2]:
+				enemy.health -= 20
+				enemy.knockback = vector_converter(10,
+					math.atan2(enemy.rect.center[1]-explosion[1],enemy.rect.center[0]-explosion[0]))
+
+		x, y = enemy.rect.center
+		outside = max(abs(x-mid_x)-WSX/2, abs(y-mid_y)-WSY/2) # how far past the screen edge the centre is
+		if outside > RECYCLE_MARGIN:
+			director.recycle(enemy)
+			continue
+
+		interval = 1
+		if lod:
+			for margin, interval in LOD_BANDS:
+				if outside < margin: break
+			else: interval = LOD_FAR
+		if interval == 1 or (tick+enemy.uid) % interval == 0:
+			enemy.update(enemy.lag+1)
+			enemy.lag = 0
+		else:
+			enemy.lag += 1
+	adversaries.sweep() # dead enemies are removed after everyone has updated exactly once
+
 #-----------------------------UPGRADES---------------------------------------------
 
 # upgrade functions
@@ -209,6 +651,7 @@ upgrade_list = (
 )
 
 current_upgrades = []
+picked_upgrade = None # index picked since the last tick, recorded with the next one
 
 def required_exp(): return 250*player.level**1.4+2000
 
@@ -218,25 +661,446 @@ def upgrade_check():
 		state = 'upgrade'
 		player.exp -= required_exp()
 		player.level += 1
-		current_upgrades = r.sample(upgrade_list, k=3)
+		current_upgrades = rng_upgrades.sample(upgrade_list, k=3)
 
-def upgrade_picker():
-	global state, player_shoot_cooldown
-	if pygame.Rect(WSX/4-150, WSY/2-60, 300, 120).collidepoint(mouse_pos):
-		current_upgrades[0][1]()
-	elif pygame.Rect(WSX/4*2-150, WSY/2-60, 300, 120).collidepoint(mouse_pos):
-		current_upgrades[1][1]()
-	elif pygame.Rect(WSX/4*3-150, WSY/2-60, 300, 120).collidepoint(mouse_pos):
-		current_upgrades[2][1]()
-	else: return
+def pick_upgrade(i):
+	"""Applies the i-th offered upgrade and resumes the game, noting the pick for the replay"""
+	global state, picked_upgrade
+	current_upgrades[i][1]()
+	picked_upgrade = i
 	state = 'play'
 
+def upgrade_picker():
+	for i in range(3):
+		if pygame.Rect(WSX/4*(i+1)-150, WSY/2-60, 300, 120).collidepoint(mouse_pos):
+			pick_upgrade(i)
+			return
+
+#--------------------------------SPRITE-CACHE--------------------------------------
+
+# procedurally drawn shapes are rasterised once here and blitted afterwards
+BULLET_HEADINGS = 64 # player bullet sprites are quantised to this many directions
+
+@lru_cache(maxsize=None)
+def bullet_sprite(heading, aa=True):
+	"""Player bullet quadrilateral for a heading bucket, returned with the offset of its centre"""
+	theta = heading/BULLET_HEADINGS*2*math.pi
+	vx, vy = vector_converter(5, theta)
+	c = 8
+	hitbox = [(c-vx+vy/3, c-vy-vx/3), (c+vx+vy/3, c+vy-vx/3), (c+vx-vy/3, c+vy+vx/3), (c-vx-vy/3, c-vy+vx/3)]
+	sprite = pygame.Surface((c*2+1, c*2+1), pygame.SRCALPHA)
+	# transparent in the shape's colour so antialiased edges don't darken, outline first as gfxdraw
+	# overwrites (rather than blends) the alpha of per-pixel alpha surfaces
+	sprite.fill((*WHITE, 0))
+	if aa: gfx.aapolygon(sprite, hitbox, WHITE)
+	gfx.filled_polygon(sprite, hitbox, WHITE)
+	return sprite, c
+
+@lru_cache(maxsize=None)
+def orb_sprite(aa=True):
+	"""Enemy bullet, returned with the offset of its centre"""
+	c = 6
+	sprite = pygame.Surface((c*2+1, c*2+1), pygame.SRCALPHA)
+	sprite.fill((*RED, 0))
+	if aa: gfx.aacircle(sprite, c, c, 5, RED)
+	gfx.filled_circle(sprite, c, c, 5, RED)
+	gfx.arc(sprite, c, c, 2, 10, 80, WHITE)
+	gfx.arc(sprite, c, c, 3, 10, 80, WHITE)
+	return sprite, c
+
+@lru_cache(maxsize=None)
+def ring_sprite(radius, aa=True, scale=1):
+	"""Explosion shockwave ring at a radius (they grow in fixed steps) with its thickness scaled, returned with the offset of its centre"""
+	thickness = (40-abs(radius-40))/5*scale
+	c = radius + round(thickness) + 2
+	sprite = pygame.Surface((c*2+1, c*2+1), pygame.SRCALPHA)
+	sprite.fill((*WHITE, 0))
+	for j in range(round(thickness)):
+		# each circle is blended in from its own layer so the overlapping antialiasing adds up
+		circle = sprite.copy()
+		(gfx.aacircle if aa else gfx.circle)(circle, c, c, round(radius+j-thickness/2), WHITE)
+		sprite.blit(circle, (0, 0))
+	return sprite, c
+
+#--------------------------------RENDER-QUEUE--------------------------------------
+
+class RenderQueue:
+	# (surface, dest) pairs collected per layer during DRAW(), each layer is submitted with a single
+	# Surface.blits call in the order the layers were declared
+	def __init__(self, layers):
+		self.layers = {name: [] for name in layers}
+
+	def add(self, layer, surface, dest):
+		self.layers[layer].append((surface, dest))
+
+	def extend(self, layer, pairs):
+		self.layers[layer].extend(pairs)
+
+	def flush(self, target):
+		for batch in self.layers.values():
+			if batch:
+				target.blits(batch, doreturn=False)
+				batch.clear()
+
+render_queue = RenderQueue(('player_bullets', 'player', 'boss', 'enemies', 'enemy_bullets', 'explosions'))
+
+#--------------------------------HUD-----------------------------------------------
+
+class HUD:
+	# the screen border and top bar readouts, cached on surfaces and only redrawn when what they show changes
+	top_height = 50 # the top bar strip, everything below it is static border
+
+	def __init__(self):
+		self.size = None
+
+	def bake(self):
+		"""Draws the static border once and cuts it into a top bar plus the left, right and bottom strips"""
+		self.size = screen.get_size()
+		frame = pygame.Surface(self.size).convert()
+		for rect in [(0, 0, WSX, 40), # top
+				(0, 40, 20, WSY-40), # left
+				(WSX-20, 40, 20, WSY-40), # right
+				(20, WSY-20, WSX-40, 20)]: # bottom
+			gfx.box(frame, rect, DARKEST_GREY)
+		for rect in [(20, 40, WSX-40, 10), # top
+				(20, 50, 10, WSY-80), # left
+				(WSX-30, 50, 10, WSY-80), # right
+				(20, WSY-30, WSX-40, 10)]: # bottom
+			gfx.box(frame, rect, DARKER_GREY)
+
+		self.border_top = frame.subsurface((0, 0, WSX, self.top_height)).copy()
+		self.top = self.border_top.copy()
+		self.strips = [(frame.subsurface(rect).copy(), rect[:2]) for rect in [
+			(0, self.top_height, 30, WSY-self.top_height), # left
+			(WSX-30, self.top_height, 30, WSY-self.top_height), # right
+			(30, WSY-30, WSX-60, 30)]] # bottom
+
+		# each readout has its own transparent layer over the top bar, redrawn when its key changes
+		self.parts = {
+			'hearts': self.draw_hearts,
+			'rounds': self.draw_rounds,
+			'score':  self.draw_score,
+			'exp':    self.draw_exp,
+		}
+		self.layers = {name: pygame.Surface((WSX, self.top_height), pygame.SRCALPHA) for name in self.parts}
+		self.keys = {}
+
+	def draw_hearts(self, layer):
+		layer.blits([(images['heart_shadow'], (20+i*25,5)) for i in range(player.max_health)], doreturn=False)
+		layer.blits([(images['heart'], (20+i*25,5)) for i in range(player.health)], doreturn=False)
+
+	def draw_rounds(self, layer):
+		if player.max_rounds <= 16:
+			layer.blits([(images['bullet_shadow'], (WSX-50-i*12, 7)) for i in range(player.max_rounds)], doreturn=False)
+			layer.blits([(images['bullet'], (WSX-50-i*12, 7)) for i in range(player.rounds)], doreturn=False)
+		else:
+			textbox(ASfont[20], f"{player.rounds:02d}/{player.max_rounds}", (WSX-45, 23), alignment='midright', surface=layer)
+			layer.blit(images['bullet'], (WSX-50, 7))
+
+	def draw_score(self, layer):
+		textbox(ASfont[20], str(score), (WSX/2, 15), surface=layer)
+
+	def draw_exp(self, layer):
+		gfx.rectangle(layer, (WSX/6, 25, WSX*2/3, 10), WHITE)
+		gfx.box(layer, (WSX/6, 25, WSX*2/3*player.exp/(required_exp()), 10), WHITE)
+
+	def render(self):
+		if self.size != screen.get_size(): self.bake()
+
+		keys = {
+			'hearts': (player.max_health, player.health),
+			'rounds': (player.max_rounds, player.rounds),
+			'score':  score,
+			'exp':    round(WSX*2/3*player.exp/required_exp()), # bar width in pixels
+		}
+		if keys != self.keys:
+			for name, draw in self.parts.items():
+				if keys[name] != self.keys.get(name):
+					self.layers[name].fill((0, 0, 0, 0))
+					draw(self.layers[name])
+			self.keys = keys
+
+			# recompose the top bar from the border and every layer
+			self.top.blit(self.border_top, (0, 0))
+			for layer in self.layers.values(): self.top.blit(layer, (0, 0))
+
+		screen.blit(self.top, (0, 0))
+		for strip, pos in self.strips: screen.blit(strip, pos)
+
+hud = HUD()
+
+#--------------------------------TELEMETRY-----------------------------------------
+
+# timed phases of a frame (ms, UPDATE() phases summed over every tick run in it) and the counts kept with them
+TELEMETRY_PHASES = ('events', 'update_player', 'update_projectiles', 'update_enemies', 'update_explosions',
+	'update_spawning', 'draw_background', 'draw_entities', 'draw_flush', 'draw_hud', 'overlay', 'flip', 'idle')
+TELEMETRY_COUNTS = ('ticks', 'enemies', 'bullets', 'explosions')
+# histogram bins (ms) for the exported percentiles, about 1% wide from 1 us to 10 s
+TELEMETRY_BINS = np.concatenate(([0], np.geomspace(1e-3, 1e4, 1601)))
+
+class Telemetry:
+	# per frame phase timings and entity counts in a ring buffer of the last `capacity` frames for the
+	# overlay ([T]); with --telemetry every frame is also handed to a writer thread, so no disk I/O in frames
+	def __init__(self, capacity=600, export=None):
+		self.columns = ('frame',) + TELEMETRY_PHASES + TELEMETRY_COUNTS
+		self.column = {name: i for i, name in enumerate(self.columns)}
+		self.timed = 1 + len(TELEMETRY_PHASES) # frame time and phases come before the counts
+		self.buffer = np.zeros((capacity, len(self.columns)))
+		self.row = np.zeros(len(self.columns)) # the frame being recorded
+		self.frames = 0 # frames recorded so far, the next goes into row frames % capacity
+		self.start = self.last = time.perf_counter()
+		self.visible = False
+		self.panel = None # overlay, redrawn a few times a second
+		self.queue = None
+		if export:
+			export.parent.mkdir(parents=True, exist_ok=True)
+			self.queue = queue.Queue()
+			self.writer = threading.Thread(target=self.write, args=(export,), daemon=True)
+			self.writer.start()
+
+	def lap(self, phase):
+		"""Adds the time since the previous lap to a phase of the current frame"""
+		now = time.perf_counter()
+		self.row[self.column[phase]] += (now-self.last)*1000
+		self.last = now
+
+	def end_frame(self, ticks):
+		"""Stores the current frame with its length and entity counts, then starts the next"""
+		now = time.perf_counter()
+		row = self.row
+		row[0] = (now-self.start)*1000
+		row[self.timed:] = (ticks, len(adversaries), len(projectiles), len(explosion_drawings))
+
+		capacity = len(self.buffer)
+		self.buffer[self.frames % capacity] = row
+		self.frames += 1
+		if self.queue and self.frames % capacity == 0: self.queue.put(self.buffer.copy())
+		if self.visible and self.frames % 15 == 0: self.summarise()
+
+		row[:] = 0
+		self.start = self.last = now
+
+	def percentiles(self, rows):
+		"""p50/p95/p99 of every timed column, shape (3, timed)"""
+		return np.percentile(rows[:, :self.timed], (50, 95, 99), axis=0)
+
+	def summarise(self):
+		"""Draws the percentile table (ms over the buffered frames) and the latest entity counts"""
+		recorded = self.buffer[:min(self.frames, len(self.buffer))]
+		p = self.percentiles(recorded)
+		self.panel = pygame.Surface((360, 25*(self.timed+2)+10), pygame.SRCALPHA)
+		self.panel.fill((0, 0, 0, 160))
+		x, y = 10, 5
+		for j, heading in enumerate(('p50', 'p95', 'p99')):
+			textbox(ASfont[20], heading, (x+240+j*55, y), alignment='topright', surface=self.panel)
+		# the numbers change on every redraw, so they skip the text caches rather than evict what they hold
+		for i, name in enumerate(self.columns[:self.timed]):
+			textbox(ASfont[20], name, (x, y+25*(i+1)), alignment='topleft', surface=self.panel)
+			for j, value in enumerate(p[:, i]):
+				textbox(ASfont[20], f"{value:.2f}", (x+240+j*55, y+25*(i+1)), alignment='topright', surface=self.panel, cached=False)
+		latest = recorded[(self.frames-1) % len(self.buffer), self.timed:]
+		counts = ' | '.join(f"{name} {int(value)}" for name, value in zip(TELEMETRY_COUNTS, latest))
+		textbox(ASfont[20], counts, (x, y+25*(self.timed+1)), alignment='topleft', surface=self.panel, cached=False)
+
+	def toggle(self):
+		self.visible = not self.visible
+		if self.visible and self.frames: self.summarise()
+
+	def render(self):
+		"""The overlay under the top bar"""
+		if self.visible and self.panel: screen.blit(self.panel, (10, hud.top_height+15))
+
+	def write(self, path):
+		"""Writer thread: appends the handed over blocks to <path>.csv and once closed writes <path>.json,
+		keeping only running totals, maxima and histograms of the blocks however long the run"""
+		formats = ['%.3f']*self.timed + ['%d']*len(TELEMETRY_COUNTS)
+		frames, bins = 0, len(TELEMETRY_BINS)-1
+		totals, maxima = np.zeros(self.timed), np.zeros(len(self.columns))
+		histograms = np.zeros((self.timed, bins), np.int64)
+		with open(path.with_suffix('.csv'), 'w') as file:
+			file.write(','.join(self.columns)+'\n')
+			while (block := self.queue.get()) is not None:
+				np.savetxt(file, block, fmt=formats, delimiter=',')
+				if not len(block): continue
+				frames += len(block)
+				totals += block[:, :self.timed].sum(axis=0)
+				maxima = np.maximum(maxima, block.max(axis=0))
+				binned = np.clip(np.searchsorted(TELEMETRY_BINS, block[:, :self.timed], 'right')-1, 0, bins-1)
+				histograms += np.bincount((binned + np.arange(self.timed)*bins).ravel(), minlength=self.timed*bins).reshape(self.timed, bins)
+
+		summary = {'frames': frames}
+		if frames:
+			# percentiles to within a bin: the upper edge of the bin holding the nth frame, or the maximum if lower
+			ranks = np.ceil(np.array((.5, .95, .99))*frames)
+			p = np.minimum(TELEMETRY_BINS[1:][np.argmax(np.cumsum(histograms, axis=1)[:, None, :] >= ranks[None, :, None], axis=2)],
+				maxima[:self.timed, None])
+			summary['ms'] = {name: {'mean': float(totals[i]/frames), 'p50': float(p[i, 0]), 'p95': float(p[i, 1]),
+				'p99': float(p[i, 2]), 'max': float(maxima[i])} for i, name in enumerate(self.columns[:self.timed])}
+			summary['max_counts'] = {name: int(maxima[self.timed+i]) for i, name in enumerate(TELEMETRY_COUNTS)}
+		path.with_suffix('.json').write_text(json.dumps(summary, indent='\t'))
+
+	def close(self):
+		"""Hands the unsaved frames to the writer and waits for the files to be written"""
+		if not self.queue: return
+		self.queue.put(self.buffer[:self.frames % len(self.buffer)].copy())
+		self.queue.put(None)
+		self.writer.join()
+		self.queue = None
+
+telemetry = Telemetry(export=Path('telemetry') / f"telemetry_{datetime.now():%Y%m%d_%H%M%S}"
+	if '--telemetry' in sys.argv else None)
+
+#---------------------------------NOTICES------------------------------------------
+
+# short messages for the player (files written, errors) shown above the bottom right overlay lines;
+# headless runs have no screen, so there they go to stdout
+NOTICE_SECONDS = 5
+notices = [] # (message, colour, shown until)
+
+def notify(message, color=WHITE):
+	if HEADLESS: print(message)
+	else: notices.append((message, color, time.perf_counter()+NOTICE_SECONDS))
+
+def render_notices():
+	"""Draws the current notices, newest lowest, and drops the expired ones"""
+	now = time.perf_counter()
+	notices[:] = [notice for notice in notices if notice[2] > now]
+	for i, (message, color, _) in enumerate(reversed(notices)):
+		textbox(ASfont[20], message, (WSX, WSY-125-25*i), color=color, alignment='bottomright', cached=False)
+
+#---------------------------------PROFILER-----------------------------------------
+
+# [P] or --profile [SECONDS] captures the next PROFILE_SECONDS of the main loop into profiles/, as a
+# cProfile dump (.prof, open with pstats/snakeviz) or with --sampling as sampled stacks (.folded, for flame graphs)
+PROFILE_SECONDS = 10
+if '--profile' in sys.argv:
+	profile_arg = sys.argv[sys.argv.index('--profile')+1:][:1]
+	if profile_arg and profile_arg[0].replace('.', '', 1).isdigit(): PROFILE_SECONDS = float(profile_arg[0])
+PROFILE_MODE = 'sampling' if '--sampling' in sys.argv else 'cprofile'
+SAMPLE_INTERVAL = 0.001
+
+class Profiler:
+	# one capture at a time, stopped by update() once its time is up (or by stop() on exit)
+	def __init__(self, mode):
+		self.mode = mode
+		self.path = None # set while capturing
+		self.end = None
+		self.profile = None
+		self.sampler = None
+		self.stacks = Counter() # sampled call stacks of the last sampling capture
+
+	def start(self, seconds=None):
+		"""Starts capturing for a number of seconds (None runs until stop()), named after the current game state"""
+		if self.path: return
+		tags = [datetime.now().strftime('%Y%m%d_%H%M%S'), state]
+		if active_boss: tags.append('boss')
+		tags += [f"{len(adversaries)}enemies", f"{len(projectiles)}bullets"]
+		self.path = Path('profiles') / f"profile_{'_'.join(tags)}"
+		self.path.parent.mkdir(exist_ok=True)
+		self.end = time.perf_counter()+seconds if seconds is not None else None
+
+		if self.mode == 'cprofile':
+			self.profile = cProfile.Profile()
+			self.profile.enable()
+		else:
+			self.sampler = threading.Thread(target=self.sample, args=(threading.main_thread().ident,), daemon=True)
+			self.sampler.start()
+
+	def sample(self, thread_id):
+		"""Sampler thread: counts the main thread's call stacks every SAMPLE_INTERVAL until stopped"""
+		stacks = Counter()
+		while self.path:
+			frame = sys._current_frames().get(thread_id)
+			stack = []
+			while frame:
+				stack.append(f"{Path(frame.f_code.co_filename).name}:{frame.f_code.co_name}")
+				frame = frame.f_back
+			stacks[';'.join(reversed(stack))] += 1
+			time.sleep(SAMPLE_INTERVAL)
+		self.stacks = stacks
+
+	def update(self):
+		"""Called every frame, ends the capture once its time is up"""
+		if self.path and self.end is not None and time.perf_counter() >= self.end: self.stop()
+
+	def stop(self):
+		"""Ends the capture and writes its file"""
+		if not self.path: return
+		path, self.path = self.path, None
+		if self.mode == 'cprofile':
+			self.profile.disable()
+			path = path.with_suffix('.prof')
+			self.profile.dump_stats(path)
+		else:
+			self.sampler.join()
+			path = path.with_suffix('.folded')
+			path.write_text(''.join(f"{stack} {count}\n" for stack, count in self.stacks.most_common()))
+		notify(f"profile written to {path}")
+
+	def render(self):
+		if self.path:
+			left = f" {max(self.end-time.perf_counter(), 0):.0f}s" if self.end is not None else ''
+			textbox(ASfont[20], f"profiling ({self.mode}){left}", (WSX, WSY-50), color=RED, alignment='bottomright')
+
+profiler = Profiler(PROFILE_MODE)
+
+#---------------------------------QUALITY------------------------------------------
+
+# optional costs by quality level, cheapest first: antialiased sprites, explosion ring thickness, the tiled
+# background (a flat fill of its colour otherwise), ticks between each enemy's separation pass and spawn rate
+QUALITY_LEVELS = (
+	{'aa': False, 'ring': .5,  'tiles': False, 'separation': 4, 'spawn_rate': .7},
+	{'aa': False, 'ring': .5,  'tiles': True,  'separation': 2, 'spawn_rate': .85},
+	{'aa': True,  'ring': .75, 'tiles': True,  'separation': 2, 'spawn_rate': 1},
+	{'aa': True,  'ring': 1,   'tiles': True,  'separation': 1, 'spawn_rate': 1},
+)
+QUALITY_TOP = len(QUALITY_LEVELS)-1
+QUALITY_BUDGET = 1000/TICK_RATE # ms of work per frame
+QUALITY_WINDOW = 60 # frames per decision, the next window starts after a change
+QUALITY_DOWN = 1    # steps down when the window's p90 frame is over this share of the budget
+QUALITY_UP = .5     # and back up only under this share, so it doesn't flip between two levels
+QUALITY = int(sys.argv[sys.argv.index('--quality')+1]) if '--quality' in sys.argv else None # pins a level
+
+class Quality:
+	# the controller moves the level one step at a time from the frame times; the simulation settings
+	# are taken per tick (tick_level) and recorded in replays, so a replay plays out at the levels it had
+	def __init__(self, fixed=None):
+		self.fixed = fixed
+		self.level = QUALITY_TOP if fixed is None else clamp(fixed, 0, QUALITY_TOP)
+		self.tick_level = self.level
+		self.frames = []
+
+	@property
+	def draw(self):
+		return QUALITY_LEVELS[self.level]
+
+	@property
+	def sim(self):
+		return QUALITY_LEVELS[self.tick_level]
+
+	def update(self, frame_ms):
+		"""Takes the work time of a frame (without flip or the frame cap, which wait on the display), stepping at the end of each window"""
+		if self.fixed is not None: return
+		self.frames.append(frame_ms)
+		if len(self.frames) < QUALITY_WINDOW: return
+		p90 = sorted(self.frames)[int(len(self.frames)*.9)]
+		self.frames.clear()
+		if p90 > QUALITY_BUDGET*QUALITY_DOWN and self.level > 0: self.level -= 1
+		elif p90 < QUALITY_BUDGET*QUALITY_UP and self.level < QUALITY_TOP: self.level += 1
+
+	def render(self):
+		if self.level != QUALITY_TOP:
+			textbox(ASfont[20], f"quality {self.level}/{QUALITY_TOP}" + (' (auto)' if self.fixed is None else ''),
+				(WSX, WSY-100), color=RED, alignment='bottomright')
+
+quality = Quality(QUALITY)
+
 #--------------------------------PRIMARY-FUNCS-------------------------------------
 
 def UPDATE():
 	"""GAME LOGIC"""
 	global level_time, timec, score, active_boss, state
-	level_time += 1/60
+	level_time += 1/TICK_RATE
 
 	if int(level_time) > timec:
 		score += 10
@@ -245,180 +1109,122 @@ def UPDATE():
 	player.update()
 
 	upgrade_check()
+	telemetry.lap('update_player')
 
-	# writes the current global offset(distance moved) from the original start point
-	global_offset[0] += global_dx
-	global_offset[1] += global_dy
+	# the camera follows the player, whose hitbox stays in the middle of the screen
+	camera[0] -= global_dx
+	camera[1] -= global_dy
+	player.rect.topleft = (round(camera[0]+WSX/2-10), round(camera[1]+WSY/2-10))
 
-	# updates the player projectiles
-	try:
-		for i in range(len(player_projectiles)):
-			player_projectiles[i].update()
-			if player_projectiles[i].delete:
-					del player_projectiles[i]
-	except IndexError: # To avoid end of list error
-		pass
+	# moves every bullet and culls the ones that left the screen
+	projectiles.update()
+
+	# bullet hits are resolved once for everything before the enemies update
+	enemy_grid.rebuild(adversaries)
+	resolve_projectile_hits()
+	telemetry.lap('update_projectiles')
 
 	if active_boss:
 		active_boss.update()
 		if active_boss.delete:
 			active_boss = None
 
-	# updates enemies
-	try:
-		for i in range(len(adversaries)):
-			for explosion in explosions:
-				if math.sqrt((explosion[0]-adversaries[i].rect.center[0])**2+(explosion[1]-adversaries[i].rect.center[1])**2)<=explosion[2]:
-					adversaries[i].health -= 20
-					adversaries[i].knockback = vector_converter(10,
-						math.atan2(adversaries[i].rect.center[1]-explosion[1],adversaries[i].rect.center[0]-explosion[0]))
-			adversaries[i].update()
-			if adversaries[i].delete:
-					del adversaries[i]
-	except IndexError: # To avoid end of list error
-		pass
-
-	# updates the enemy projectiles
-	try:
-		for i in range(len(enemy_projectiles)):
-			enemy_projectiles[i].update()
-			if enemy_projectiles[i].delete:
-					del enemy_projectiles[i]
-	except IndexError: # To avoid end of list error
-		pass
+	# explosion rings from earlier ticks grow until they fade out
+	for drawing in explosion_drawings:
+		drawing[2] += 8
+	explosion_drawings[:] = [drawing for drawing in explosion_drawings if drawing[2] < 80]
 
-	try:
-		for i in range(len(explosions)):
-			if explosions[i][3]:
-				del explosions[i]
-			else:
-				explosions[i][3] = 1
-	except IndexError:
-		pass
-
-	for i in range(len(explosion_drawings)):
-		explosion_drawings[i][0] += global_dx
-		explosion_drawings[i][1] += global_dy
-
-	# enemy spawn mechanic
-	if level_time < 15:
-		pass
-	elif level_time < 45:
-		pass
-	else:
-		pass
-
-	# if len(adversaries) < 0: # testing
-	rng = r.randint(0, 80 + len(adversaries)*2 - clamp(round(level_time*.08), 0, 5)*4)
-	if rng < 5:
-		x = r.randint(-100, WSX+100)
-		y = r.randint(-100, WSY+100)
-
-		if x < 20 or x > WSX-20 or y < 20 or y > WSY-20:
-			if rng < 3:
-				adversaries.append(Enemy(x, y))
-			elif rng < 4:
-				adversaries.append(rangedEnemy(x, y))
-			else:
-				adversaries.append(exploderEnemy(x, y))
+	update_enemies()
+	telemetry.lap('update_enemies')
 
-	if not active_boss and level_time >= 120: active_boss = Boss(300, -50)
+	# explosions deal damage for two ticks, then get compacted out
+	explosions[:] = [explosion for explosion in explosions if not explosion[3]]
+	for explosion in explosions:
+		explosion[3] = 1
+
+	telemetry.lap('update_explosions')
+
+	director.update()
+	telemetry.lap('update_spawning')
 
 def DRAW():
 	"""DRAWING CODE"""
 	global current_upgrades
 
-	screen.fill(DARKEST_GREY)
+	# the start screen covers everything else, so the game itself (and its assets) isn't needed yet
+	if state == 'start':
+		screen.fill((0x8+10, 0x8+4, 0x8+8))
+		textbox(ASfont[60], 'Press [SPACE] to start game', (WSX/2, WSY/3))
+		instructions = [
+			'Use [WASD]/↑←↓→ to move',
+			'Use mouse to aim and LMB to shoot',
+			'Reload pressing RMB or [r]',
+			'Pause game with [SPACE]'
+			'',
+			'Kill enemies to earn points and experience',
+			'Survive and defeat the boss'
+			'',
+			'Press [Esc] to quit game'
+		]
+		for i in range(len(instructions)):
+			textbox(ASfont[20], instructions[i], (WSX/2, WSY/3*2+i*25))
+
+		# progress of the assets still streaming in
+		progress = assets.progress()
+		if progress < 1:
+			textbox(ASfont[20], f"Loading assets... {round(progress*100)}%", (WSX/2, WSY/2-15))
+			gfx.rectangle(screen, (WSX/2-150, WSY/2, 300, 6), WHITE)
+			gfx.box(screen, (WSX/2-150, WSY/2, 300*progress, 6), WHITE)
+		telemetry.lap('draw_hud')
+		return
 
-	# draws a looping background taking into account the global offset
-	# only draws the minimum number of tiles required in order to not waste resources
-	for x in range(-bg_length, WSX, bg_length):
-		for y in range(-bg_length, WSY, bg_length):
-			screen.blit(background_tile, (x + global_offset[0]%bg_length, y + global_offset[1]%bg_length))
+	# the camera moved by -global_dx/dy this tick, drawing lags it by the part of a tick not yet reached
+	global draw_camera
+	draw_camera = (camera[0] + global_dx*(1-render_alpha), camera[1] + global_dy*(1-render_alpha))
+	view = pygame.Rect(draw_camera, (WSX, WSY)).inflate(200, 200) # anything outside isn't drawn, with room for sprite overhang
 
-	gfx.box(screen, (0, 0, WSX, WSY), (0, 0, 0, 100))
+	# draws the looping, already darkened background scrolled by the camera
+	background.render((-draw_camera[0], -draw_camera[1]), quality.draw['tiles'])
+	telemetry.lap('draw_background')
 
-	# draws the player bullets
-	for bullet in player_projectiles:
-		bullet.render()
+	# queues the player bullets, player, boss, enemies, enemy bullets and explosions
+	projectiles.render(PLAYER_OWNED, view)
 
-	# draws the player
 	player.render()
 
-	if active_boss: active_boss.render()
+	if active_boss and view.colliderect(active_boss.rect): active_boss.render()
 
-	# draws the enemies
 	for enemy in adversaries:
-		enemy.render()
+		if view.colliderect(enemy.rect): enemy.render()
 
-	# draws the enemy bullets
-	for bullet in enemy_projectiles:
-		bullet.render()
+	projectiles.render(ENEMY_OWNED, view)
 
-	# drawing the explosions
-	try:
-		for i in range(len(explosion_drawings)):
-			thickness = (40-abs(explosion_drawings[i][2]-40))/5
-			for j in range(round(thickness)):
-				gfx.aacircle(screen,
-					round(explosion_drawings[i][0]),
-					round(explosion_drawings[i][1]),
-					round(explosion_drawings[i][2]+j-thickness/2),
-					WHITE)
-				if explosion_drawings[i][2] >= 80:
-					del explosion_drawings[i]
-			explosion_drawings[i][2] += 8
-	except IndexError: # To avoid end of list error
-		pass
+	for drawing in explosion_drawings:
+		sprite, c = ring_sprite(drawing[2], quality.draw['aa'], quality.draw['ring'])
+		render_queue.add('explosions', sprite, (round(drawing[0]-draw_camera[0])-c, round(drawing[1]-draw_camera[1])-c))
+
+	telemetry.lap('draw_entities')
+
+	# then draws them layer by layer
+	render_queue.flush(screen)
+	telemetry.lap('draw_flush')
 
 	if active_boss:
 		gfx.box(screen, [WSX/4, 60, round(active_boss.health/boss_max_health*WSX/2), 8], RED)
 		for i in range(2):
 			gfx.rectangle(screen, [WSX/4-1-i, 59-i, WSX/2+2+i, 10+i], WHITE)
 
-	# draws a screen border
-	rects = [(0, 0, WSX, 40), # top
-			(0, 40, 20, WSY-40), # left
-			(WSX-20, 40, 20, WSY-40), # right
-			(20, WSY-20, WSX-40, 20)] # bottom
-	for rect in rects:
-		gfx.box(screen, rect, DARKEST_GREY)
-
-	rects = [(20, 40, WSX-40, 10), # top
-			(20, 50, 10, WSY-80), # left
-			(WSX-30, 50, 10, WSY-80), # right
-			(20, WSY-30, WSX-40, 10)] # bottom
-	for rect in rects:
-		gfx.box(screen, rect, DARKER_GREY)
-
 	# draws UI elements
 	# drawing the reload bar
 	if player.reloading:
 		gfx.rectangle(screen, (WSX/2-15, WSY/2-18, 30, 6), WHITE)
 		gfx.box(screen, (
 			WSX/2-15, WSY/2-18,
-			30*((player.reload_length*60-player.reload_timer)/(player.reload_length*60)
+			30*((player.reload_length*TICK_RATE-player.reload_timer)/(player.reload_length*TICK_RATE)
 				), 6), WHITE)
-	# drawing the hearts
-	for i in range(player.max_health):
-		screen.blit(images['heart_shadow'], (20+i*25,5))
-	for i in range(player.health):
-		screen.blit(images['heart'], (20+i*25,5))
-
-	# drawing the rounds
-	if player.max_rounds <= 16:
-		for i in range(player.max_rounds):
-			screen.blit(images['bullet_shadow'], (WSX-50-i*12, 7))
-		for i in range(player.rounds):
-			screen.blit(images['bullet'], (WSX-50-i*12, 7))
-	else:
-		textbox(ASfont[20], f"{player.rounds:02d}/{player.max_rounds}", (WSX-45, 23), alignment='midright')
-		screen.blit(images['bullet'], (WSX-50, 7))
-
-	textbox(ASfont[20], str(score), (WSX/2, 15))
 
-	gfx.rectangle(screen, (WSX/6, 25, WSX*2/3, 10), WHITE)
-	gfx.box(screen, (WSX/6, 25, WSX*2/3*player.exp/(required_exp()), 10), WHITE)
+	# draws the screen border, hearts, rounds, score and exp bar
+	hud.render()
 
 	# adds a semi-transparent layer when paused
 	if state != 'play': gfx.box(screen, (0, 0, WSX, WSY), (0, 0, 0, 100))
@@ -445,22 +1251,7 @@ def DRAW():
 		textbox(ASfont[60], "You Died" if state == 'death' else "You Win", (WSX/2, WSY/4), color=(255, 150, 150) if state == 'death' else (150, 255, 150))
 		textbox(ASfont[40], f"Final Score: {str(score)}", (WSX/2, WSY/5*2))
 		textbox(ASfont[20], 'Press [SPACE] to go back to main menu', (WSX/2, WSY/4*3))
-	elif state == 'start':
-		screen.fill((0x8+10, 0x8+4, 0x8+8))
-		textbox(ASfont[60], 'Press [SPACE] to start game', (WSX/2, WSY/3))
-		instructions = [
-			'Use [WASD]/↑←↓→ to move',
-			'Use mouse to aim and LMB to shoot',
-			'Reload pressing RMB or [r]',
-			'Pause game with [SPACE]'
-			'',
-			'Kill enemies to earn points and experience',
-			'Survive and defeat the boss'
-			'',
-			'Press [Esc] to quit game'
-		]
-		for i in range(len(instructions)):
-			textbox(ASfont[20], instructions[i], (WSX/2, WSY/3*2+i*25))
+	telemetry.lap('draw_hud')
 
 #---------------------------------CLASSES------------------------------------------
 
@@ -472,7 +1263,7 @@ class Player(pygame.sprite.Sprite):
 		self.rect = pygame.Rect(WSX/2-10, WSY/2-10, 20, 40) # hitbox
 		self.speed = player_speed
 
-		self.image = images_player['idle']['down'][0]
+		self.image = None # picked from the animation frames every update
 		self.animation_state = "idle"  # 'idle' or 'walk'
 		self.frame = 0
 		self.direction = 'down'
@@ -499,6 +1290,11 @@ class Player(pygame.sprite.Sprite):
 		self.shoot_cooldown = self.max_cooldown
 		self.spread = 12 # 10ths of a degree on either side
 
+	def __getstate__(self): # snapshots leave out the animation frame surface, the next update picks it again
+		state = self.__dict__.copy()
+		state['image'] = None
+		return state
+
 	def update(self):
 		global state, global_dx, global_dy, explosions # grabbing the global variables
 
@@ -563,7 +1359,7 @@ class Player(pygame.sprite.Sprite):
 		# reload start
 		if (mouse_right_click or reloadtrig) and not self.reloading and self.rounds != self.max_rounds:
 			self.reloading = True
-			self.reload_timer = self.reload_length * 60
+			self.reload_timer = self.reload_length * TICK_RATE
 
 		# update reload counter
 		if self.reloading:
@@ -576,17 +1372,17 @@ class Player(pygame.sprite.Sprite):
 		# shooting
 		elif mouse_left_held:
 			if self.shoot_cooldown <= 0:
-				dx = mouse_pos[0] - self.rect.center[0]
-				dy = mouse_pos[1] - self.rect.center[1]
+				dx = mouse_pos[0]+camera[0] - self.rect.center[0]
+				dy = mouse_pos[1]+camera[1] - self.rect.center[1]
 
 				theta = math.atan2(dy, dx)
-				theta += math.radians(r.randint(-self.spread, self.spread)*.1)*2 if x_movement or y_movement else math.radians(r.randint(-self.spread, self.spread)*.1)
-				player_projectiles.append(playerProjectile(self.rect.center[0], self.rect.center[1], theta, self.damage))
+				theta += math.radians(rng_combat.randint(-self.spread, self.spread)*.1)*2 if x_movement or y_movement else math.radians(rng_combat.randint(-self.spread, self.spread)*.1)
+				projectiles.spawn(self.rect.center[0], self.rect.center[1], theta, PLAYER_OWNED, self.damage)
 				self.rounds -= 1
 
 				if self.rounds == 0:
 					self.reloading = True
-					self.reload_timer = self.reload_length * 60
+					self.reload_timer = self.reload_length * TICK_RATE
 
 				self.shoot_cooldown = self.max_cooldown
 		
@@ -597,24 +1393,25 @@ class Player(pygame.sprite.Sprite):
 		if self.invincibility:
 			self.invincibility -= 1
 
+		cx, cy = camera[0]+WSX/2, camera[1]+WSY/2 # where the player stands in the world
 		if explosions and not self.invincibility:
 			for explosion in explosions:
-				if math.sqrt((explosion[0]-WSX/2)**2+(explosion[1]-WSY/2)**2)<=explosion[2]:
+				if math.sqrt((explosion[0]-cx)**2+(explosion[1]-cy)**2)<=explosion[2]:
 					self.invincibility = 90
 					self.health -= 2
-					self.knockback = vector_converter(self.knockback_speed*2, math.atan2(WSY/2-explosion[1],WSX/2-explosion[0]))
+					self.knockback = vector_converter(self.knockback_speed*2, math.atan2(cy-explosion[1],cx-explosion[0]))
 
 		# collision check for enemies and projectiles
-		hit = self.rect.collideobjects(adversaries, key=lambda enemy : enemy.rect)
-		if not hit: hit = self.rect.collideobjects(enemy_projectiles, key=lambda bullet : bullet.enemy_hitbox)
-		if hit and not self.invincibility:
+		hit = self.rect.collideobjects(adversaries.live, key=lambda enemy : enemy.rect)
+		bullet = None if hit else projectiles.first_hit(self.rect, ENEMY_OWNED)
+		if (hit or bullet is not None) and not self.invincibility:
 			self.invincibility = 60
 			self.health -= 1
-			if isinstance(hit, Enemy):
-				self.knockback = vector_converter(self.knockback_speed, math.atan2(WSY/2-hit.rect.center[1],WSX/2-hit.rect.center[0]))
-			elif isinstance(hit, enemyProjectile):
-				self.knockback = hit.knockback
-				enemy_projectiles.remove(hit)
+			if hit:
+				self.knockback = vector_converter(self.knockback_speed, math.atan2(cy-hit.rect.center[1],cx-hit.rect.center[0]))
+			else:
+				self.knockback = projectiles.knockback[bullet].tolist()
+				projectiles.kill(bullet)
 		
 		if self.health <= 0:
 			state = 'death'
@@ -629,85 +1426,138 @@ class Player(pygame.sprite.Sprite):
 		speed = 6 if (mouse_left_held and not self.reloading) else 12
 
 		# update frame counter (loops after 8 frames)
-		self.frame += 1 / 60 * speed
+		self.frame += 1 / TICK_RATE * speed
 		self.frame %= 8
 
 		# get current animation frame
 		self.image = images_player[self.animation_state][self.direction][int(self.frame)]
 
 	def render(self): # drawing the player
+		if self.image is None: return # no frame is picked until the first tick has run
 		self.image.set_alpha(abs(7.5-self.invincibility%15)*34)
-		screen.blit(self.image, (self.rect.x-32, self.rect.y-35))
+		render_queue.add('player', self.image, (round(WSX/2-10)-32, round(WSY/2-10)-35)) # always mid screen
 		# gfx.filled_circle(screen, round(WSX/2), round(WSY/2), 150, [255, 0, 0, 20])
 		# gfx.box(screen, self.rect, [0, 0, 255, 50])
 
-class Projectile(pygame.sprite.Sprite):
-	# base projectile object for all uses
-	def __init__(self, x, y, theta):
-		super().__init__()
-		self.x = x
-		self.y = y
-
-		self.v = vector_converter(projectile_speed, theta)
-
-		self.enemy_hitbox = pygame.Rect(self.x, self.y, 4, 4)
-		self.player_hitbox = []
-
-		self.delete = False
-
-		self.knockback = vector_converter(5, theta)
-
-	def update(self): # movement
-		global global_dx
-		global global_dy
-
-		self.x += self.v[0] + global_dx
-		self.y += self.v[1] + global_dy
-
-		if self.x > WSX or self.x < 0 or self.y > WSY or self.y < 0:
-			self.delete = True
-
-class playerProjectile(Projectile):
-	def __init__(self, x, y, theta, damage):
-		super().__init__(x, y, theta)
-		self.v = vector_converter(player_projectile_speed, theta)
-		self.damage = damage
+class ProjectileStore:
+	# every bullet in the game, kept as numpy arrays (one row per bullet) so they move,
+	# cull and hit-test in a handful of vectorised operations instead of per object
+	columns = ('pos', 'prev', 'vel', 'damage', 'knockback', 'owner', 'alive')
+
+	def __init__(self, capacity=256):
+		self.count = 0 # rows [0, count) are in use, dead rows are compacted away each update
+		self.pos       = np.zeros((capacity, 2))
+		self.prev      = np.zeros((capacity, 2)) # position at the start of the tick, for interpolated drawing
+		self.vel       = np.zeros((capacity, 2))
+		self.damage    = np.zeros(capacity)
+		self.knockback = np.zeros((capacity, 2))
+		self.owner     = np.zeros(capacity, np.int8)
+		self.alive     = np.zeros(capacity, bool)
+
+	def __len__(self):
+		return int(self.alive[:self.count].sum())
+
+	def __getstate__(self): # only the rows in use
+		return {name: getattr(self, name)[:self.count].copy() for name in self.columns}
+
+	def __setstate__(self, state):
+		count = len(state['alive'])
+		self.__init__(max(256, count*2))
+		for name, rows in state.items(): getattr(self, name)[:count] = rows
+		self.count = count
+
+	def clear(self):
+		self.count = 0
+
+	def spawn(self, x, y, theta, owner, damage=1):
+		"""Adds a bullet heading at angle theta, growing the buffers when full"""
+		if self.count == len(self.alive):
+			for name in self.columns:
+				array = getattr(self, name)
+				setattr(self, name, np.concatenate((array, np.zeros_like(array))))
+
+		i = self.count
+		speed = player_projectile_speed if owner == PLAYER_OWNED else enemy_projectile_speed
+		self.pos[i] = self.prev[i] = (x, y)
+		self.vel[i] = vector_converter(speed, theta)
+		self.damage[i] = damage
+		self.knockback[i] = vector_converter(5, theta)
+		self.owner[i] = owner
+		self.alive[i] = True
+		self.count += 1
+
+	def kill(self, i):
+		self.alive[i] = False
 
 	def update(self):
-		super().update()
-		vx = self.v[0] / (player_projectile_speed / 5)
-		vy = self.v[1] / (player_projectile_speed / 5)
-		self.player_hitbox = [ # quadrilateral hitbox
-		(self.x-vx+vy/3, self.y-vy-vx/3),
-		(self.x+vx+vy/3, self.y+vy-vx/3),
-		(self.x+vx-vy/3, self.y+vy+vx/3),
-		(self.x-vx-vy/3, self.y-vy+vx/3)]
-
-	def render(self):
-		if len(self.player_hitbox) < 4: return # scraps buggy hitboxes
-		gfx.aapolygon(screen, self.player_hitbox, WHITE)
-		gfx.filled_polygon(screen, self.player_hitbox, WHITE)
-
-class enemyProjectile(Projectile):
-	def __init__(self, x, y, theta):
-		super().__init__(x, y, theta)
-		self.v = vector_converter(enemy_projectile_speed, theta)
-
-	def update(self):
-		super().update()
-		self.enemy_hitbox.center = (self.x, self.y)
-
-	def render(self):
-		gfx.filled_circle(screen, round(self.x), round(self.y), 5, RED)
-		gfx.aacircle(screen, round(self.x), round(self.y), 5, RED)
-		gfx.arc(screen, round(self.x), round(self.y), 2, 10, 80, WHITE)
-		gfx.arc(screen, round(self.x), round(self.y), 3, 10, 80, WHITE)
+		"""Movement, culling of the bullets that left the screen and compaction of the dead rows"""
+		n = self.count
+		if not n: return
+		pos = self.pos[:n]
+		self.prev[:n] = pos
+		pos += self.vel[:n]
+		x, y = pos[:, 0]-camera[0], pos[:, 1]-camera[1]
+		self.alive[:n] &= (x >= 0) & (x <= WSX) & (y >= 0) & (y <= WSY)
+
+		keep = self.alive[:n]
+		if keep.all(): return
+		kept = int(keep.sum())
+		for name in self.columns:
+			array = getattr(self, name)
+			array[:kept] = array[:n][keep]
+		self.count = kept
+
+	def live(self, owner):
+		"""Indices of the living bullets fired by owner"""
+		n = self.count
+		if not n: return np.empty(0, int)
+		return np.flatnonzero(self.alive[:n] & (self.owner[:n] == owner))
+
+	def hitbox_corners(self, idx):
+		"""Quadrilateral player bullet hitboxes, shape (len(idx), 4, 2)"""
+		pos = self.pos[idx]
+		v = self.vel[idx] / (player_projectile_speed / 5)
+		perp = v[:, ::-1] * (1/3, -1/3)
+		return np.stack((pos-v+perp, pos+v+perp, pos+v-perp, pos-v-perp), axis=1)
+
+	def first_hit(self, rect, owner):
+		"""Index of the first living bullet of owner whose 4x4 hitbox overlaps rect, else None"""
+		idx = self.live(owner)
+		if not len(idx): return None
+		x, y = self.pos[idx, 0], self.pos[idx, 1]
+		hit = idx[(x-2 < rect.right) & (x+2 > rect.left) & (y-2 < rect.bottom) & (y+2 > rect.top)]
+		return int(hit[0]) if len(hit) else None
+
+	def render(self, owner, view):
+		"""Queues the cached sprite of every living bullet of owner inside the view rect"""
+		idx = self.live(owner)
+		prev = self.prev[idx]
+		pos = prev + (self.pos[idx]-prev)*render_alpha
+		inside = (pos[:, 0] >= view.left) & (pos[:, 0] < view.right) & (pos[:, 1] >= view.top) & (pos[:, 1] < view.bottom)
+		idx, pos = idx[inside], pos[inside] - draw_camera
+		if owner == PLAYER_OWNED:
+			vel = self.vel[idx]
+			headings = np.rint(np.arctan2(vel[:, 1], vel[:, 0])/(2*math.pi)*BULLET_HEADINGS).astype(int) % BULLET_HEADINGS
+			sprites = [bullet_sprite(heading, quality.draw['aa']) for heading in headings.tolist()]
+			render_queue.extend('player_bullets', [(sprite, (x-c, y-c))
+				for (sprite, c), (x, y) in zip(sprites, np.floor(pos).astype(int).tolist())])
+		else:
+			sprite, c = orb_sprite(quality.draw['aa'])
+			render_queue.extend('enemy_bullets', [(sprite, dest)
+				for dest in (np.rint(pos).astype(int) - c).tolist()])
 
 class Enemy(pygame.sprite.Sprite):
 	# basic enemy object
+	size = (16, 22) # hitbox
+
 	def __init__(self, x, y):
 		super().__init__()
-		self.rect = pygame.Rect(x, y, 16, 22)
+		self.rect = pygame.Rect((x, y), self.size)
+		self.spawn(x, y)
+
+	def spawn(self, x, y): # (re)sets the enemy for a new life, also used when the pool recycles it
+		self.rect.topleft = (x, y)
+		self.prev = self.rect.topleft # position at the start of the tick, for interpolated drawing
 		self.dirx = 'right'
 		self.knockback = [0,0]
 		self.speed = enemy_speed
@@ -715,113 +1565,148 @@ class Enemy(pygame.sprite.Sprite):
 		self.health = 25
 		self.points = 100
 
+		self.hits = [] # (damage, knockback) queued by resolve_projectile_hits()
 		self.delete = False
+		self.lag = 0 # ticks skipped by update_enemies() since the last update
+		self.unseparated = 0 # ticks since the last separation pass
+
+	def __getstate__(self): # snapshots keep just the flash alpha of the primed sprites
+		state = self.__dict__.copy()
+		if 'primed_sprites' in state: state['primed_sprites'] = [image.get_alpha() for image in self.primed_sprites]
+		return state
 
-	def processes(self): # common enemy functions
-		global score, global_dx, global_dy
+	def __setstate__(self, state):
+		self.__dict__.update(state)
+		if 'primed_sprites' in state:
+			self.primed_sprites = self.primed_images()
+			for image, alpha in zip(self.primed_sprites, state['primed_sprites']): image.set_alpha(alpha)
+
+	def processes(self, steps): # common enemy functions, steps is how many ticks this update covers
+		global score
+		self.prev = self.rect.topleft
 
 		# knockback handling
-		if abs(self.knockback[0]) > .5 and abs(self.knockback[1]) > .5:
+		for _ in range(steps):
+			if not (abs(self.knockback[0]) > .5 and abs(self.knockback[1]) > .5): break
 			self.rect.x += self.knockback[0]
 			self.rect.y += self.knockback[1]
 			self.knockback = [x/1.1 for x in self.knockback]
 
-		# damage check using point based collision for quadrilateral hitboxes
-		for n in range(len(player_projectiles)):
-			for i in range(4):
-				if self.rect.collidepoint(player_projectiles[n].player_hitbox[i]):
-					self.health -= player_projectiles[n].damage
-					self.knockback = player_projectiles[n].knockback
-					player_projectiles.pop(n)
+		# damage from the bullets that hit this tick
+		for damage, knockback in self.hits:
+			self.health -= damage
+			self.knockback = knockback
+		self.hits.clear()
 
 		if self.health <= 0:
 			self.delete = True
 			score += self.points
 			player.exp += self.points
 
-		# prevent enemy stacking
-		comrades = [enemy for enemy in adversaries if enemy != self]
+		# prevent enemy stacking, only checking comrades in the neighbouring grid cells;
+		# lower quality checks less often and pushes for every tick since the last check
+		self.unseparated += steps
+		if self.unseparated < quality.sim['separation']: return
+		steps, self.unseparated = self.unseparated, 0
+		comrades = enemy_grid.query(self.rect)
 
 		collisions = self.rect.collideobjectsall(comrades, key=lambda comrade : comrade.rect)
 		if collisions:
 			for comrade in collisions:
+				if comrade is self: continue
 				if self.rect.center[0] > comrade.rect.center[0]:
-					self.rect.x += 1
+					self.rect.x += steps
 				else:
-					self.rect.x -= 1
+					self.rect.x -= steps
 				if self.rect.center[1] > comrade.rect.center[1]:
-					self.rect.y += 1
+					self.rect.y += steps
 				else:
-					self.rect.y -= 1
+					self.rect.y -= steps
 
-	def update(self):
-		self.processes()
+	def update(self, steps=1):
+		self.processes(steps)
 
 		# player tracking
-		dx = WSX/2 - self.rect.center[0]
-		dy = WSY/2 - self.rect.center[1]
+		dx = camera[0]+WSX/2 - self.rect.center[0]
+		dy = camera[1]+WSY/2 - self.rect.center[1]
 		theta = math.atan2(dy, dx)
 		self.v = vector_converter(self.speed, theta)
 
-		self.rect.x += self.v[0] + global_dx
-		self.rect.y += self.v[1] + global_dy
+		self.rect.x += self.v[0]*steps
+		self.rect.y += self.v[1]*steps
 
 		self.dirx = 'right' if dx >= 0 else 'left'
 
 
+	def render_pos(self):
+		"""Screen position of the hitbox's top left between its last two ticks, so drawing is smooth above the tick rate"""
+		return (self.prev[0] + (self.rect.x-self.prev[0])*render_alpha - draw_camera[0],
+			self.prev[1] + (self.rect.y-self.prev[1])*render_alpha - draw_camera[1])
+
 	def render(self):
-		if self.dirx == 'right': screen.blit(images['enemy_basic_r'], (self.rect.x-12, self.rect.y-5))
-		else: screen.blit(images['enemy_basic_l'], (self.rect.x-5, self.rect.y-5))
+		x, y = self.render_pos()
+		if self.dirx == 'right': render_queue.add('enemies', images['enemy_basic_r'], (x-12, y-5))
+		else: render_queue.add('enemies', images['enemy_basic_l'], (x-5, y-5))
 		# gfx.box(screen, self.rect, [0, 255, 0, 50])
 
 class rangedEnemy(Enemy):
-	def __init__(self, x, y):
-		super().__init__(x, y)
-		self.rect = pygame.Rect(x, y, 16, 20)
+	size = (16, 20)
+
+	def spawn(self, x, y):
+		super().spawn(x, y)
 
 		self.shoot_cooldown = enemy_shoot_cooldown/2
 
 		self.health = 35
 		self.points = 150
 
-	def update(self):
-		self.processes()
+	def update(self, steps=1):
+		self.processes(steps)
 
 		# shooting
-		if not self.shoot_cooldown:
-			dx = WSX/2 - self.rect.center[0]
-			dy = WSY/2 - self.rect.center[1]
+		if self.shoot_cooldown <= 0:
+			dx = camera[0]+WSX/2 - self.rect.center[0]
+			dy = camera[1]+WSY/2 - self.rect.center[1]
 
 			theta = math.atan2(dy, dx)
-			enemy_projectiles.append(enemyProjectile(self.rect.center[0], self.rect.center[1], theta))
+			projectiles.spawn(self.rect.center[0], self.rect.center[1], theta, ENEMY_OWNED)
 
 			self.shoot_cooldown = enemy_shoot_cooldown
 
-		self.shoot_cooldown -= 1
+		self.shoot_cooldown -= steps
 
-		dx = WSX/2 - self.rect.center[0]
-		dy = WSY/2 - self.rect.center[1]
+		dx = camera[0]+WSX/2 - self.rect.center[0]
+		dy = camera[1]+WSY/2 - self.rect.center[1]
 		if dx**2+dy**2 >= 120**2: # prevents getting too close to player
 			theta = math.atan2(dy, dx)
 			self.v = vector_converter(self.speed, theta)
 		else:
 			self.v = [0, 0]
 
-		self.rect.x += self.v[0] + global_dx
-		self.rect.y += self.v[1] + global_dy
+		self.rect.x += self.v[0]*steps
+		self.rect.y += self.v[1]*steps
 
 		self.dirx = 'right' if dx >= 0 else 'left'
 
 	def render(self):
-		if self.dirx == 'right': screen.blit(images['enemy_shooter_r'], (self.rect.x-12, self.rect.y-4))
-		else: screen.blit(images['enemy_shooter_l'], (self.rect.x-5, self.rect.y-5))
+		x, y = self.render_pos()
+		if self.dirx == 'right': render_queue.add('enemies', images['enemy_shooter_r'], (x-12, y-4))
+		else: render_queue.add('enemies', images['enemy_shooter_l'], (x-5, y-5))
 		# gfx.box(screen, self.rect, [0, 255, 0, 50])
 
 class exploderEnemy(Enemy):
+	size = (20, 18)
+
 	def __init__(self, x, y):
+		self.primed_sprites = self.primed_images()
 		super().__init__(x, y)
-		self.rect = pygame.Rect(x, y, 20, 18)
-		self.primed_sprites = [images['enemy_exploder_primed_r'].copy(), images['enemy_exploder_primed_l'].copy()]
+
+	def primed_images(self): # own copies so each exploder flashes separately, kept when the enemy is recycled
+		return [images['enemy_exploder_primed_r'].copy(), images['enemy_exploder_primed_l'].copy()]
+
+	def spawn(self, x, y):
+		super().spawn(x, y)
+		for image in self.primed_sprites: image.set_alpha(0)
 
 		self.speed = enemy_speed*1.4
 
@@ -832,12 +1717,12 @@ class exploderEnemy(Enemy):
 		self.health = 20
 		self.points = 200
 
-	def update(self):
-		self.processes()
+	def update(self, steps=1):
+		self.processes(steps)
 
 		# player tracking
-		dx = WSX/2 - self.rect.center[0]
-		dy = WSY/2 - self.rect.center[1]
+		dx = camera[0]+WSX/2 - self.rect.center[0]
+		dy = camera[1]+WSY/2 - self.rect.center[1]
 
 		if dx**2+dy**2 <= 80**2:
 			self.primed = True
@@ -847,34 +1732,42 @@ class exploderEnemy(Enemy):
 			theta = math.atan2(dy, dx)
 			self.v = vector_converter(self.speed, theta)
 		else:
-			self.ticks -= 1
+			self.ticks -= steps
 			for image in self.primed_sprites: image.set_alpha(abs(20-self.ticks%20)*4)
 
-		if self.ticks == 0 or self.delete:
+		if self.ticks <= 0 or self.delete:
 			explosions.append([self.rect.center[0], self.rect.center[1], self.explosion_radius, 0])
 			explosion_drawings.append([self.rect.center[0], self.rect.center[1], 1])
 			self.delete = True
 
-		self.rect.x += self.v[0] + global_dx
-		self.rect.y += self.v[1] + global_dy
+		self.rect.x += self.v[0]*steps
+		self.rect.y += self.v[1]*steps
 
 		self.dirx = 'right' if dx >= 0 else 'left'
 
 	def render(self):
+		x, y = self.render_pos()
 		if self.dirx == 'right':
-			screen.blit(images['enemy_exploder_r'], (self.rect.x-4, self.rect.y-5))
-			screen.blit(self.primed_sprites[0], (self.rect.x-4, self.rect.y-5))
+			render_queue.add('enemies', images['enemy_exploder_r'], (x-4, y-5))
+			render_queue.add('enemies', self.primed_sprites[0], (x-4, y-5))
 		else:
-			screen.blit(images['enemy_exploder_l'], (self.rect.x-3, self.rect.y-5))
-			screen.blit(self.primed_sprites[1], (self.rect.x-4, self.rect.y-5))
+			render_queue.add('enemies', images['enemy_exploder_l'], (x-3, y-5))
+			render_queue.add('enemies', self.primed_sprites[1], (x-4, y-5))
 		# gfx.box(screen, self.rect, [0, 255, 0, 100])
 		# gfx.filled_circle(screen, self.rect.center[0], self.rect.center[1], self.explosion_radius, [255, 0, 0, 50])
 
 class Boss(Enemy):
+	size = (80, 80)
+
 	def __init__(self, x, y):
+		self.primed_sprites = self.primed_images()
 		super().__init__(x, y)
-		self.rect = pygame.Rect(x, y, 80, 80)
-		self.primed_sprites = [images['boss_primed_r'], images['boss_primed_l']]
+
+	def primed_images(self):
+		return [images['boss_primed_r'], images['boss_primed_l']]
+
+	def spawn(self, x, y):
+		super().spawn(x, y)
 		for image in self.primed_sprites: image.set_alpha(0)
 
 		self.health = boss_max_health
@@ -888,7 +1781,8 @@ class Boss(Enemy):
 		self.dash_velocity = [0,0]
 
 	def update(self):
-		global score, global_dx, global_dy, state
+		global score, state
+		self.prev = self.rect.topleft
 
 		# knockback handling
 		if abs(self.knockback[0]) > .5 and abs(self.knockback[1]) > .5:
@@ -901,16 +1795,11 @@ class Boss(Enemy):
 			self.rect.y += self.dash_velocity[1]
 			self.dash_velocity = [x/1.05 for x in self.dash_velocity]
 
-		# damage check using point based collision for quadrilateral hitboxes
-		try:
-			for n in range(len(player_projectiles)):
-				for i in range(4):
-					if self.rect.collidepoint(player_projectiles[n].player_hitbox[i]):
-						self.health -= player_projectiles[n].damage
-						self.knockback = [knock*.2 for knock in player_projectiles[n].knockback]
-						player_projectiles.pop(n)
-		except IndexError:
-			pass
+		# damage from the bullets that hit this tick
+		for damage, knockback in self.hits:
+			self.health -= damage
+			self.knockback = [knock*.2 for knock in knockback]
+		self.hits.clear()
 
 		if self.health <= 0:
 			self.delete = True
@@ -918,32 +1807,17 @@ class Boss(Enemy):
 			player.exp += self.points
 			state = 'win'
 
-		# prevent enemy stacking
-		comrades = [enemy for enemy in adversaries if enemy != self]
-
-		"""collisions = self.rect.collideobjectsall(comrades, key=lambda comrade : comrade.rect)
-		if collisions:
-			for comrade in collisions:
-				if self.rect.center[0] > comrade.rect.center[0]:
-					self.rect.x += 1
-				else:
-					self.rect.x -= 1
-				if self.rect.center[1] > comrade.rect.center[1]:
-					self.rect.y += 1
-				else:
-					self.rect.y -= 1"""
-
-		dx = WSX/2 - self.rect.center[0]
-		dy = WSY/2 - self.rect.center[1]
+		dx = camera[0]+WSX/2 - self.rect.center[0]
+		dy = camera[1]+WSY/2 - self.rect.center[1]
 
 		if self.dash_timeout:
 			self.dash_timeout -= 1
 		elif self.after_dash < 60:
 			self.after_dash += 1
 
-		if self.after_dash == 30:
-			for i in range(5): adversaries.append(exploderEnemy(self.rect.center[0]+r.randint(-10, 10), self.rect.center[1]+r.randint(-10, 10)))
-			for i in range(3): adversaries.append(rangedEnemy(self.rect.center[0]+r.randint(-10, 10), self.rect.center[1]+r.randint(-10, 10)))
+		if self.after_dash == 30: # minions come in over the next few ticks, within the spawn budget
+			for i in range(5): director.queue(exploderEnemy, self.rect.center[0]+rng_spawn.randint(-10, 10), self.rect.center[1]+rng_spawn.randint(-10, 10))
+			for i in range(3): director.queue(rangedEnemy, self.rect.center[0]+rng_spawn.randint(-10, 10), self.rect.center[1]+rng_spawn.randint(-10, 10))
 
 		if self.charging:
 			for image in self.primed_sprites: image.set_alpha(abs(15-self.dash_timeout%30)*25)
@@ -964,115 +1838,553 @@ class Boss(Enemy):
 		else:
 			self.v = [0, 0]
 
-		self.rect.x += self.v[0] + global_dx
-		self.rect.y += self.v[1] + global_dy
+		self.rect.x += self.v[0]
+		self.rect.y += self.v[1]
 
 		self.dirx = 'right' if dx >= 0 else 'left'
 
 	def render(self):
+		x, y = self.render_pos()
 		if self.dirx == 'right':
-			screen.blit(images['boss_r'], (self.rect.x-25, self.rect.y-5))
-			screen.blit(images['boss_primed_r'], (self.rect.x-25, self.rect.y-5))
+			render_queue.add('boss', images['boss_r'], (x-25, y-5))
+			render_queue.add('boss', images['boss_primed_r'], (x-25, y-5))
 		else:
-			screen.blit(images['boss_l'], (self.rect.x, self.rect.y-5))
-			screen.blit(images['boss_primed_l'], (self.rect.x, self.rect.y-5))
+			render_queue.add('boss', images['boss_l'], (x, y-5))
+			render_queue.add('boss', images['boss_primed_l'], (x, y-5))
 		# gfx.box(screen, self.rect, [0, 255, 0, 50])
 
+#------------------------------SPAWN-DIRECTOR--------------------------------------
+
+# wave tables, the last phase started is in effect: (from level time in seconds, mean ticks between spawns
+# with no enemies around, weights of SPAWN_KINDS); every living enemy puts SPAWN_CROWDING more ticks in between
+SPAWN_KINDS = (Enemy, rangedEnemy, exploderEnemy)
+SPAWN_WAVES = (
+	(0,  56, (4, 1, 0)),
+	(15, 50, (3, 1, 1)),
+	(45, 44, (2, 1, 1)),
+)
+SPAWN_CROWDING = 1.4
+SPAWN_BUDGET = 2 # enemies added per tick at most, bursts wait in the queue for the next ticks
+SPAWN_CAP = 200 # nothing spawns while this many enemies are alive
+RECYCLE_MARGIN = 2400 # enemies left further behind the screen edge come back in at an edge
+BOSS_TIME = 120
+
+class SpawnDirector:
+	# decides what spawns from the wave tables, then adds queued enemies within the budget and cap
+	def __init__(self):
+		self.pending = [] # (class, x, y), x and y None for a random point on the screen edge
+
+	def queue(self, cls, x=None, y=None):
+		if len(self.pending) < SPAWN_CAP: self.pending.append((cls, x, y))
+
+	def recycle(self, enemy):
+		"""Takes out an enemy left far behind (worth no score) and queues a new one of its kind"""
+		enemy.delete = True
+		self.queue(type(enemy))
+
+	def edge_point(self):
+		"""Random world point from 100 px outside to 20 px inside the screen edge"""
+		while True:
+			x, y = rng_spawn.randint(-100, WSX+100), rng_spawn.randint(-100, WSY+100)
+			if x < 20 or x > WSX-20 or y < 20 or y > WSY-20: return x+round(camera[0]), y+round(camera[1])
+
+	def update(self):
+		global active_boss
+		wave = [wave for wave in SPAWN_WAVES if level_time >= wave[0]][-1]
+		if rng_spawn.random()*(wave[1] + len(adversaries)*SPAWN_CROWDING) < quality.sim['spawn_rate']:
+			self.queue(rng_spawn.choices(SPAWN_KINDS, wave[2])[0])
+
+		room = max(0, min(SPAWN_BUDGET, SPAWN_CAP-len(adversaries)))
+		for cls, x, y in self.pending[:room]:
+			if x is None: x, y = self.edge_point()
+			adversaries.spawn(cls, x, y)
+		del self.pending[:room]
+
+		if not active_boss and level_time >= BOSS_TIME:
+			assets.require('boss')
+			active_boss = Boss(round(camera[0])+300, round(camera[1])-50)
+
 #----------------------------------------------------------------------------------
 
 done = False
 clock = pygame.time.Clock()
 
 player = Player()
+projectiles = ProjectileStore()
+adversaries = EntityPool()
+director = SpawnDirector()
+
+mouse_pos = (WSX/2, WSY/2)
+keys = pygame.key.get_pressed()
+quick_save = None # last [F5] capture
+
+def reset_game(seed=SEED):
+	"""Puts back the fresh world captured at start-up, under a new session seed"""
+	begin_run(fresh_world, reseed=True, seed=seed)
+
+#---------------------------------HEADLESS-----------------------------------------
+
+class ScriptedKeys:
+	# stands in for pygame.key.get_pressed() when input comes from a script
+	def __init__(self, pressed=()):
+		self.pressed = set(pressed)
+
+	def __getitem__(self, key):
+		return key in self.pressed
+
+def simulate(ticks, script=None, reset=True, seed=SEED):
+	"""Steps UPDATE() for up to a number of ticks with scripted input (from a fresh game under seed
+	unless reset is False), returns the ticks run
+
+	script(tick) returns a dict with any of: 'keys' (held pygame keys), 'mouse_pos',
+	'shoot' (LMB held), 'reload' (RMB clicked) and 'upgrade' (card index 0-2)
+	"""
+	global keys, mouse_pos, mouse_left_held, mouse_right_click, reloadtrig, state
+	if reset: reset_game(seed)
+	assets.require('play')
+	state = 'play'
 
-#----------------------------------------------------------------------------------
+	for tick in range(ticks):
+		inputs = script(tick) if script else {}
+		keys = ScriptedKeys(inputs.get('keys', ()))
+		mouse_pos = inputs.get('mouse_pos', (WSX/2, WSY/2))
+		mouse_left_held = inputs.get('shoot', False)
+		mouse_right_click = inputs.get('reload', False)
+		reloadtrig = False
+
+		if state == 'upgrade': pick_upgrade(inputs.get('upgrade', 0))
+		if state != 'play': return tick
+
+		step_game()
+		telemetry.end_frame(1) # every tick is a frame of its own here
+	return ticks
+
+def demo_script(tick):
+	"""Simple soak-test input: strafes in a slow circle and fires at the closest enemy"""
+	directions = ((pygame.K_w,), (pygame.K_w, pygame.K_d), (pygame.K_d,), (pygame.K_d, pygame.K_s),
+				(pygame.K_s,), (pygame.K_s, pygame.K_a), (pygame.K_a,), (pygame.K_a, pygame.K_w))
+	targets = adversaries.live + [active_boss] if active_boss else adversaries.live
+	aim = (WSX/2, WSY/2)
+	if targets:
+		x, y = min(targets, key=lambda enemy : (enemy.rect.centerx-player.rect.centerx)**2+(enemy.rect.centery-player.rect.centery)**2).rect.center
+		aim = (x-camera[0], y-camera[1])
+	return {'keys': directions[tick//90 % 8], 'mouse_pos': aim, 'shoot': bool(targets)}
+
+#---------------------------------SNAPSHOT-----------------------------------------
+
+# bumped whenever what a captured world holds changes, snapshots and replays of other versions are refused
+# 1 first snapshots, 2 world space positions behind a camera, 3 enemy ids, update lag and the lod setting,
+# 4 the spawn director's queue, 5 ticks since each enemy's separation pass
+WORLD_VERSION = 5
+
+# module globals that make up a run, next to the offered upgrades and the RNG streams
+WORLD_GLOBALS = ('state', 'score', 'level_time', 'timec', 'player_speed', 'global_dx', 'global_dy', 'camera', 'lod',
+	'player', 'projectiles', 'adversaries', 'director', 'active_boss', 'explosions', 'explosion_drawings', 'session_seed')
+
+def capture_world():
+	"""The whole run pickled into bytes"""
+	world = {name: globals()[name] for name in WORLD_GLOBALS}
+	world['version'] = WORLD_VERSION
+	world['current_upgrades'] = [upgrade_list.index(upgrade) for upgrade in current_upgrades]
+	world['rngs'] = {name: stream.getstate() for name, stream in RNG_STREAMS.items()}
+	return pickle.dumps(world, pickle.HIGHEST_PROTOCOL)
+
+# the only globals a captured world refers to: the game classes it holds, and what numpy arrays and pygame
+# rects pickle as (across numpy versions); snapshots and replays get passed around, so nothing else is loaded
+WORLD_CLASSES = {cls.__name__: cls for cls in (Player, ProjectileStore, EntityPool, SpawnDirector,
+	Enemy, rangedEnemy, exploderEnemy, Boss)}
+WORLD_LIBRARY_GLOBALS = {('numpy', 'ndarray'), ('numpy', 'dtype'),
+	('numpy.core.multiarray', '_reconstruct'), ('numpy._core.multiarray', '_reconstruct'),
+	('numpy.core.numeric', '_frombuffer'), ('numpy._core.numeric', '_frombuffer'),
+	('pygame.rect', 'Rect'), ('pygame', 'Rect'), ('pygame', '__rect_constructor')}
+
+class WorldUnpickler(pickle.Unpickler):
+	# finds the game classes whether the game runs as __main__ or was imported as a module, and
+	# refuses every other global
+	def find_class(self, module, name):
+		if module in ('__main__', __name__, Path(__file__).stem) and name in WORLD_CLASSES: return WORLD_CLASSES[name]
+		if (module, name) in WORLD_LIBRARY_GLOBALS: return super().find_class(module, name)
+		raise pickle.UnpicklingError(f"{module}.{name} is not part of a game snapshot")
+
+def restore_world(data):
+	"""Puts back a run captured by capture_world()"""
+	global current_upgrades, picked_upgrade
+	world = WorldUnpickler(io.BytesIO(data)).load()
+	if world.get('version', 1) != WORLD_VERSION:
+		raise ValueError(f"the world was captured by another version of the game (format {world.get('version', 1)}, "
+			f"this version reads {WORLD_VERSION})")
+	current_upgrades = [upgrade_list[i] for i in world['current_upgrades']]
+	for name, rng_state in world['rngs'].items(): RNG_STREAMS[name].setstate(rng_state)
+	globals().update({name: world[name] for name in WORLD_GLOBALS})
+	picked_upgrade = None
+
+def world_digest():
+	"""Short hash of everything gameplay depends on, equal only if two runs played out exactly the same"""
+	enemies = [(type(enemy).__name__, enemy.rect.topleft, enemy.health) for enemy in adversaries]
+	boss = (active_boss.rect.topleft, active_boss.health) if active_boss else None
+	parts = (state, score, level_time, camera, player.rect.topleft, player.health, player.exp, player.level,
+		player.rounds, enemies, boss, len(explosion_drawings))
+	return hashlib.sha1(repr(parts).encode() + projectiles.pos[:projectiles.count].tobytes()).hexdigest()[:16]
+
+def check_format(data, magic, path, kind):
+	"""Raises a ValueError unless data starts with magic, saying so when it is another version's format"""
+	if data[:len(magic)] == magic: return
+	if data[:4] == magic[:4]:
+		raise ValueError(f"{path} is a {kind} from another version of the game (format {data[4:len(magic)].decode(errors='replace')}, "
+			f"this version reads {WORLD_VERSION})")
+	raise ValueError(f"{path} is not a {kind}")
+
+SNAPSHOT_MAGIC = b'AZSS%d' % WORLD_VERSION
+QUICKSAVE = Path('snapshots') / 'quicksave.azs'
+
+def save_snapshot(path, world=None):
+	"""Writes a captured world (the current one by default) compressed into a file"""
+	path.parent.mkdir(exist_ok=True)
+	path.write_bytes(SNAPSHOT_MAGIC + zlib.compress(world or capture_world(), 1))
+
+def load_snapshot(path):
+	data = Path(path).read_bytes()
+	check_format(data, SNAPSHOT_MAGIC, path, 'snapshot')
+	return zlib.decompress(data[len(SNAPSHOT_MAGIC):])
+
+def begin_run(world, reseed=False, seed=None):
+	"""Carries on from a captured world as a new run, saving the previous recording and starting the next"""
+	global playback, recording, replay_tick
+	finish_recording()
+	playback = None
+	restore_world(world)
+	if reseed: seed_rngs(seed)
+	replay_tick = 0
+	if RECORD: recording = Replay(session_seed)
+
+#----------------------------------REPLAY------------------------------------------
+
+# a replay holds the session seed, one packed input record per tick and, every KEYFRAME_INTERVAL ticks,
+# a compressed world snapshot and digest, so playback can seek and check it still plays out the same
+REPLAY_MAGIC = b'AZRP%d' % WORLD_VERSION # keyframes are captured worlds
+REPLAY_KEYS = (pygame.K_w, pygame.K_a, pygame.K_s, pygame.K_d, pygame.K_UP, pygame.K_LEFT, pygame.K_DOWN, pygame.K_RIGHT)
+REPLAY_TICK = struct.Struct('<BBhh') # held REPLAY_KEYS bits, flags (1 shoot, 2 reload, 4*(upgrade pick+1),
+	# 16*(levels below the top quality)), mouse x, y
+KEYFRAME_INTERVAL = 600
+RECORD = '--record' in sys.argv
+
+class Replay:
+	def __init__(self, seed):
+		self.seed = seed
+		self.inputs = bytearray()
+		self.keyframes = {} # tick: compressed capture_world() from just before that tick
+		self.digests = {}   # tick: world_digest() at the same point, plus one after the last tick
+		self.mismatches = [] # ticks whose digest differed while playing back
+
+	def __len__(self):
+		return len(self.inputs)//REPLAY_TICK.size
+
+	def keyframe(self, tick):
+		self.keyframes[tick] = zlib.compress(capture_world())
+		self.digests[tick] = world_digest()
+
+	def record(self):
+		"""Appends the current inputs as the next tick"""
+		held = sum(1 << i for i, key in enumerate(REPLAY_KEYS) if keys[key])
+		pick = 0 if picked_upgrade is None else picked_upgrade+1
+		flags = mouse_left_held | (mouse_right_click or reloadtrig) << 1 | pick << 2 | (QUALITY_TOP-quality.tick_level) << 4
+		self.inputs += REPLAY_TICK.pack(held, flags, *mouse_pos)
+
+	def apply(self, tick):
+		"""Sets the inputs recorded for a tick, picking its upgrade if one was picked before it"""
+		global keys, mouse_pos, mouse_left_held, mouse_right_click, reloadtrig
+		held, flags, x, y = REPLAY_TICK.unpack_from(self.inputs, tick*REPLAY_TICK.size)
+		keys = ScriptedKeys(key for i, key in enumerate(REPLAY_KEYS) if held >> i & 1)
+		mouse_pos = (x, y)
+		mouse_left_held = bool(flags & 1)
+		mouse_right_click = bool(flags & 2)
+		reloadtrig = False
+		quality.tick_level = QUALITY_TOP - (flags >> 4)
+		if flags >> 2 & 3 and state == 'upgrade': pick_upgrade((flags >> 2 & 3)-1)
+
+	def verify(self, tick):
+		if tick in self.digests and world_digest() != self.digests[tick]: self.mismatches.append(tick)
+
+	def seek(self, tick):
+		"""Restores the closest keyframe at or before tick, then replays the inputs from there up to it"""
+		global replay_tick
+		tick = clamp(tick, 0, len(self)-1)
+		replay_tick = max(keyframe for keyframe in self.keyframes if keyframe <= tick)
+		restore_world(zlib.decompress(self.keyframes[replay_tick]))
+		while replay_tick < tick: step_game()
+
+	def save(self, path):
+		"""Header (seed, digests and where each block starts) followed by the input records and keyframes"""
+		blobs, blocks, offset = [bytes(self.inputs)], {}, len(self.inputs)
+		for tick, keyframe in sorted(self.keyframes.items()):
+			blocks[tick] = (offset, len(keyframe))
+			blobs.append(keyframe)
+			offset += len(keyframe)
+		header = json.dumps({'seed': self.seed, 'tick_rate': TICK_RATE, 'ticks': len(self),
+			'digests': self.digests, 'keyframes': blocks}).encode()
+		path.parent.mkdir(exist_ok=True)
+		with open(path, 'wb') as file:
+			file.write(REPLAY_MAGIC + len(header).to_bytes(4, 'little') + header)
+			for blob in blobs: file.write(blob)
+
+	@classmethod
+	def load(cls, path):
+		data = Path(path).read_bytes()
+		check_format(data, REPLAY_MAGIC, path, 'replay')
+		header_length = int.from_bytes(data[len(REPLAY_MAGIC):len(REPLAY_MAGIC)+4], 'little')
+		start = len(REPLAY_MAGIC)+4
+		header = json.loads(data[start:start+header_length])
+		blocks = start + header_length
+		replay = cls(header['seed'])
+		replay.inputs = bytearray(data[blocks:blocks+header['ticks']*REPLAY_TICK.size])
+		replay.digests = {int(tick): digest for tick, digest in header['digests'].items()}
+		replay.keyframes = {int(tick): data[blocks+offset:blocks+offset+length]
+			for tick, (offset, length) in header['keyframes'].items()}
+		return replay
+
+recording = None # the Replay being recorded (with --record), finished and saved by reset_game()
+playback = None  # the Replay being played back
+replay_tick = 0  # ticks since the recording (or the replay played back) started
+
+def finish_recording():
+	"""Saves the current recording, if it has any ticks, into replays/"""
+	global recording
+	if recording and len(recording):
+		recording.digests[len(recording)] = world_digest()
+		path = Path('replays') / f"replay_{datetime.now():%Y%m%d_%H%M%S}_{recording.seed}.azr"
+		recording.save(path)
+		notify(f"replay of {len(recording)} ticks written to {path}")
+	recording = None
+
+def start_playback(replay, tick=0):
+	global playback
+	finish_recording()
+	playback = replay
+	replay.mismatches = []
+	replay.seek(tick)
+
+def stop_playback():
+	"""Ends the playback, reporting whether every keyframe digest still matched"""
+	global playback, state
+	mismatches = playback.mismatches
+	notify(f"replay ended at tick {replay_tick}: " + (f"diverged at ticks {mismatches}" if mismatches else "all digests match"),
+		RED if mismatches else WHITE)
+	playback = None
+	if state == 'play': state = 'pause' # hands control over to the player from here
+
+def ticking():
+	"""Whether the simulation steps: while playing, and through upgrade picks made by a replay"""
+	return state == 'play' or (playback is not None and state == 'upgrade')
+
+fresh_world = capture_world() # what reset_game() goes back to
 
 #----------------------------------------------------------------------------------
 
-while not done:
-	"""time1 = datetime.now().microsecond"""
-
+class TickMeter:
+	# simulation throughput, refreshed every second: ticks per second of UPDATE() time alone
+	# (rate) and game ticks per second of real time (wall), which also includes drawing
+	def __init__(self):
+		self.ticks = 0
+		self.busy = 0
+		self.since = time.perf_counter()
+		self.rate = 0
+		self.wall = 0
+
+	def add(self, seconds):
+		self.ticks += 1
+		self.busy += seconds
+		now = time.perf_counter()
+		if now-self.since >= 1:
+			self.rate = self.ticks/max(self.busy, 1e-9)
+			self.wall = self.ticks/(now-self.since)
+			self.ticks, self.busy, self.since = 0, 0, now
+
+tick_meter = TickMeter()
+
+def step_game():
+	"""Runs one UPDATE() tick, recording or playing back its inputs, spends the one-shot inputs and times it"""
+	global mouse_pos, mouse_right_click, reloadtrig, picked_upgrade, replay_tick
+	quality.tick_level = quality.level
+	if playback: playback.apply(replay_tick)
+	mouse_pos = (round(mouse_pos[0]), round(mouse_pos[1])) # whole pixels, as recorded
+	if recording is not None:
+		if not recording.keyframes: recording.keyframe(0)
+		recording.record()
+	picked_upgrade = None
+
+	start = time.perf_counter()
+	UPDATE()
+	tick_meter.add(time.perf_counter()-start)
 	mouse_right_click = False
 	reloadtrig = False
 
-	for event in pygame.event.get():
-		if event.type == pygame.QUIT: done = True
-
-		if event.type == pygame.MOUSEBUTTONDOWN:
-			if event.button == 1:
-				mouse_left_held = True
-			if event.button == 3:
-				mouse_right_click = True
-		if event.type == pygame.MOUSEBUTTONUP:
-			if event.button == 1:
-				mouse_left_held = False
-
-		if event.type == pygame.KEYDOWN:
-			if event.key == pygame.K_ESCAPE:
-				if state == 'start':
-					done = True
-				elif state == 'pause':
-					player = Player()
-					player_projectiles = []
-					enemy_projectiles = []
-					adversaries = []
-					explosions = []
-					explosion_drawings = []
-					active_boss = None
-					score = 0
-					level_time = 0
-					global_dx = 0
-					global_dy = 0
-					global_offset = [0, 0]
-					state = 'start'
-				elif state == 'play': state = 'pause'
-
-			if event.key == pygame.K_SPACE:
-				if state in ['play', 'pause']:
-					state = 'pause' if state == 'play' else 'play'
-				elif state in ['death', 'win']:
-					player = Player()
-					player_projectiles = []
-					enemy_projectiles = []
-					adversaries = []
-					explosions = []
-					explosion_drawings = []
-					active_boss = None
-					score = 0
-					level_time = 0
-					global_dx = 0
-					global_dy = 0
-					global_offset = [0, 0]
-					state = 'start'
-				elif state == 'start': state = 'play'
-
-			if event.key == pygame.K_r: reloadtrig = True
-
-
-		if state == 'upgrade' and event.type == pygame.MOUSEBUTTONDOWN and event.button == 1:
-			upgrade_picker()
-
-
-	mouse_pos = pygame.mouse.get_pos()
-	keys = pygame.key.get_pressed()
-
-	#-----------------------------------------------
-
-	if state == 'play': UPDATE()
-	DRAW()
-
-	#-----------------------------------------------
-	
-	textbox(ASfont[20], str(round(clock.get_fps())), (WSX, WSY), color=RED, alignment='bottomright')
-
-	pygame.display.flip()
-
-	clock.tick(60)
+	replay_tick += 1
+	if recording is not None and replay_tick % KEYFRAME_INTERVAL == 0: recording.keyframe(replay_tick)
+	if playback:
+		playback.verify(replay_tick)
+		if replay_tick >= len(playback): stop_playback()
+
+def main():
+	global done, mouse_left_held, mouse_right_click, reloadtrig, state, mouse_pos, keys, render_alpha, time_warp
+	global quick_save
+
+	step = 1/TICK_RATE
+	accumulator = 0
+	last = time.perf_counter()
+	reset_game()
+	if '--load' in sys.argv:
+		assets.require()
+		begin_run(load_snapshot(sys.argv[sys.argv.index('--load')+1]))
+	if '--replay' in sys.argv:
+		assets.require() # keyframes can hold the boss
+		start_playback(Replay.load(sys.argv[sys.argv.index('--replay')+1]))
+	if '--profile' in sys.argv: profiler.start(PROFILE_SECONDS)
+
+	while not done:
+		now = time.perf_counter()
+		accumulator = min(accumulator + now-last, MAX_TICKS_PER_FRAME*step)
+		last = now
+
+		for event in pygame.event.get():
+			if event.type == pygame.QUIT: done = True
+
+			if event.type == pygame.MOUSEBUTTONDOWN:
+				if event.button == 1:
+					mouse_left_held = True
+				if event.button == 3:
+					mouse_right_click = True
+			if event.type == pygame.MOUSEBUTTONUP:
+				if event.button == 1:
+					mouse_left_held = False
+
+			if event.type == pygame.KEYDOWN:
+				if event.key == pygame.K_ESCAPE:
+					if state == 'start':
+						done = True
+					elif state == 'pause':
+						reset_game()
+						state = 'start'
+					elif state == 'play': state = 'pause'
+
+				if event.key == pygame.K_SPACE:
+					if state in ['play', 'pause']:
+						state = 'pause' if state == 'play' else 'play'
+					elif state in ['death', 'win']:
+						reset_game()
+						state = 'start'
+					elif state == 'start':
+						assets.require('play')
+						state = 'play'
+
+				if event.key == pygame.K_r: reloadtrig = True
+				if event.key == pygame.K_t: telemetry.toggle()
+				if event.key == pygame.K_p: profiler.start(PROFILE_SECONDS)
+				if event.key == pygame.K_F5 and state in ('play', 'pause', 'upgrade'):
+					quick_save = capture_world()
+					save_snapshot(QUICKSAVE, quick_save)
+				if event.key == pygame.K_F9 and state != 'start' and (quick_save or QUICKSAVE.exists()):
+					assets.require()
+					try: begin_run(quick_save or load_snapshot(QUICKSAVE))
+					except (ValueError, pickle.UnpicklingError, zlib.error) as error: notify(f"quickload failed: {error}", RED)
+				if playback and event.key in (pygame.K_LEFT, pygame.K_RIGHT): # seeks 10s back or forward
+					playback.seek(replay_tick + (TICK_RATE*10 if event.key == pygame.K_RIGHT else -TICK_RATE*10))
+				if event.key == pygame.K_f:
+					time_warp = WARP_STEPS[(WARP_STEPS.index(time_warp)+1) % len(WARP_STEPS)] if time_warp in WARP_STEPS else 1
+
+
+			if state == 'upgrade' and event.type == pygame.MOUSEBUTTONDOWN and event.button == 1:
+				upgrade_picker()
+
+
+		mouse_pos = canvas_pos(pygame.mouse.get_pos())
+		keys = pygame.key.get_pressed()
+		telemetry.lap('events')
+
+		#-----------------------------------------------
+
+		# runs as many fixed ticks as the elapsed time covers, one-shot inputs are spent by the first
+		ticks = 0
+		if ticking() and time_warp == 1:
+			while accumulator >= step and ticking():
+				step_game()
+				ticks += 1
+				accumulator -= step
+			render_alpha = accumulator/step
+		# time warp ignores real time and only draws the last of its ticks
+		elif ticking():
+			frame_end = now + WARP_FRAME_BUDGET
+			while ticking() and (ticks < time_warp if time_warp != WARP_MAX else time.perf_counter() < frame_end):
+				step_game()
+				ticks += 1
+			accumulator = 0
+			render_alpha = 1
+		else:
+			accumulator = 0
+			mouse_right_click = False
+			reloadtrig = False
+			render_alpha = 1
+		DRAW()
 
-	"""time2 = datetime.now().microsecond
-				time_gap = (1 - time1 * 0.000001) - (1 - time2 * 0.000001)
-				if time_gap >= 0:
-					dt = time_gap * 60
-				else:
-					dt = 1"""
-pygame.quit()
\ No newline at end of file
+		#-----------------------------------------------
+		
+		textbox(ASfont[20], str(round(clock.get_fps())), (WSX, WSY), color=RED, alignment='bottomright')
+		if time_warp != 1:
+			textbox(ASfont[20], f"warp x{time_warp or 'max'} | {round(tick_meter.wall)} ticks/s ({round(tick_meter.rate)} UPDATE only)",
+				(WSX, WSY-25), color=RED, alignment='bottomright')
+		if playback:
+			textbox(ASfont[20], f"replay {replay_tick/TICK_RATE:.1f}s / {len(playback)/TICK_RATE:.1f}s ([←]/[→] seek 10s)",
+				(WSX, WSY-75), color=RED, alignment='bottomright')
+		telemetry.render()
+		profiler.render()
+		quality.render()
+		render_notices()
+		telemetry.lap('overlay')
+
+		work = time.perf_counter()-now # events, ticks and drawing, not the wait on vsync or the frame cap
+		present()
+		telemetry.lap('flip')
+
+		clock.tick(MAX_FPS if time_warp != WARP_MAX else 0) # 0 is uncapped
+		telemetry.lap('idle')
+		telemetry.end_frame(ticks)
+		profiler.update()
+		if time_warp == 1 and ticking(): quality.update(work*1000) # warp and menus say little about play
+
+	finish_recording()
+	profiler.stop()
+	telemetry.close()
+
+def play_replay(replay):
+	"""Plays a whole replay back as fast as possible, returns the ticks run"""
+	assets.require() # keyframes can hold the boss
+	start_playback(replay)
+	ran = 0
+	while playback:
+		step_game()
+		telemetry.end_frame(1)
+		ran += 1
+	return ran
+
+def headless_main():
+	"""Runs a scripted soak test: python azure.py --headless [--ticks N] [--seed N] [--record], or plays back --replay FILE"""
+	ticks = int(sys.argv[sys.argv.index('--ticks')+1]) if '--ticks' in sys.argv else 3600
+	start = datetime.now()
+	if '--profile' in sys.argv: profiler.start() # covers the whole run
+	if '--replay' in sys.argv: ran = play_replay(Replay.load(sys.argv[sys.argv.index('--replay')+1]))
+	elif '--load' in sys.argv:
+		assets.require()
+		begin_run(load_snapshot(sys.argv[sys.argv.index('--load')+1]))
+		ran = simulate(ticks, demo_script, reset=False)
+	else: ran = simulate(ticks, demo_script)
+	finish_recording()
+	profiler.stop()
+	elapsed = (datetime.now()-start).total_seconds()
+	print(f"{ran} ticks in {elapsed:.2f}s ({ran/max(elapsed, 1e-9):.0f} ticks/s) | "
+		f"state: {state}, score: {score}, level: {player.level}, level time: {level_time:.1f}s, "
+		f"enemies: {len(adversaries)}")
+	telemetry.close()
+
+if __name__ == '__main__':
+	if '--build-pack' in sys.argv: print(f"packed {build_asset_pack()} images into {ASSET_PACK}")
+	elif HEADLESS: headless_main()
+	else: main()
@@ -0,0 +1,141 @@
+# batch runner: plays many headless games with a scripted bot across a process pool and reports
+# survival time, score, level and per-tick cost, for balancing upgrades, required_exp() and spawn rates
+#
+# python batch.py [--runs 200] [--workers N] [--max-ticks 10800] [--base-seed 0] [--policy random] [--out FILE]
+
+import os, sys, time, json, math
+import random as r
+import multiprocessing
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+
+def option(name, default=None):
+	"""Value following a command line flag, or default"""
+	return sys.argv[sys.argv.index(name)+1] if name in sys.argv else default
+
+RUNS = int(option('--runs', 200))
+WORKERS = int(option('--workers', os.cpu_count() or 1))
+MAX_TICKS = int(option('--max-ticks', 60*180)) # 3 minutes of game time, past the boss arriving at 2
+BASE_SEED = int(option('--base-seed', 0)) # run i plays session seed BASE_SEED+i
+POLICY = option('--policy', 'random')
+
+#------------------------------------BOT-------------------------------------------
+
+# upgrade pick policies: offered upgrade names, the bot's rng -> index of the pick
+POLICIES = {
+	'random':   lambda names, rng: rng.randrange(len(names)),
+	'first':    lambda names, rng: 0,
+	'priority': lambda names, rng: min(range(len(names)), key=lambda i: UPGRADE_PRIORITY.index(names[i])),
+}
+UPGRADE_PRIORITY = ('Damage', 'Fire Rate', 'Health', 'Reload Rate', 'Speed', 'Ammo')
+
+class Bot:
+	# kites away from nearby enemies and bullets, shoots the closest target, reloads when empty
+	# or when nothing is close, and picks upgrades by a policy
+	flee_radius = 260
+	bullet_radius = 120
+
+	def __init__(self, seed, policy):
+		self.rng = r.Random(seed)
+		self.policy = POLICIES[policy]
+
+	def __call__(self, tick):
+		player = azure.player
+		px, py = player.rect.center
+		targets = azure.adversaries.live + [azure.active_boss] if azure.active_boss else azure.adversaries.live
+
+		# repulsion from everything close, strongest from the closest
+		fx = fy = 0
+		closest, closest_d = None, math.inf
+		for enemy in targets:
+			dx, dy = px-enemy.rect.centerx, py-enemy.rect.centery
+			d = math.hypot(dx, dy) or 1
+			if d < closest_d: closest, closest_d = enemy, d
+			if d < self.flee_radius: fx, fy = fx+dx/d**2, fy+dy/d**2
+		for x, y in azure.projectiles.pos[azure.projectiles.live(azure.ENEMY_OWNED)].tolist():
+			dx, dy = px-x, py-y
+			d = math.hypot(dx, dy) or 1
+			if d < self.bullet_radius: fx, fy = fx+2*dx/d**2, fy+2*dy/d**2
+
+		keys = []
+		norm = math.hypot(fx, fy)
+		if norm:
+			if fx > .3*norm: keys.append(pygame.K_d)
+			if fx < -.3*norm: keys.append(pygame.K_a)
+			if fy > .3*norm: keys.append(pygame.K_s)
+			if fy < -.3*norm: keys.append(pygame.K_w)
+
+		reload = player.rounds == 0 or (player.rounds < player.max_rounds/2 and closest_d > self.flee_radius*1.5)
+		aim = closest.rect.center if closest else (px, py)
+		inputs = {'keys': keys, 'shoot': closest is not None and not reload, 'reload': reload,
+			'mouse_pos': (aim[0]-azure.camera[0], aim[1]-azure.camera[1])} # the mouse is in screen coordinates
+		if azure.state == 'upgrade':
+			inputs['upgrade'] = self.policy([upgrade[0] for upgrade in azure.current_upgrades], self.rng)
+		return inputs
+
+#----------------------------------WORKERS-----------------------------------------
+
+def start_worker():
+	"""Pool initialiser: loads the game once per process, headless with blank images"""
+	global azure, pygame
+	os.environ['AZURE_HEADLESS'] = '1'
+	os.environ['AZURE_NO_ASSETS'] = '1'
+	import azure, pygame
+
+def play(seed):
+	"""One full game with the bot, returns its outcome row"""
+	start = time.perf_counter()
+	ticks = azure.simulate(MAX_TICKS, Bot(seed, POLICY), seed=seed)
+	elapsed = time.perf_counter()-start
+	return {'seed': seed, 'outcome': azure.state if azure.state in ('death', 'win') else 'timeout',
+		'ticks': ticks, 'survival_s': round(azure.level_time, 2), 'score': azure.score, 'level': azure.player.level,
+		'max_health': azure.player.max_health, 'ms_per_tick': elapsed*1000/max(ticks, 1)}
+
+#----------------------------------REPORT------------------------------------------
+
+def distribution(values):
+	values = np.array(values, float)
+	return {'mean': float(values.mean()), 'p10': float(np.percentile(values, 10)),
+		'median': float(np.median(values)), 'p90': float(np.percentile(values, 90))}
+
+def report(runs, elapsed):
+	outcomes = [run['outcome'] for run in runs]
+	return {
+		'meta': {'date': datetime.now().isoformat(timespec='seconds'), 'runs': len(runs), 'workers': WORKERS,
+			'max_ticks': MAX_TICKS, 'base_seed': BASE_SEED, 'policy': POLICY, 'elapsed_s': round(elapsed, 2)},
+		'throughput': {'runs_per_minute': len(runs)/elapsed*60, 'runs_per_minute_per_core': len(runs)/elapsed*60/min(WORKERS, os.cpu_count() or 1),
+			'ticks_per_second': sum(run['ticks'] for run in runs)/elapsed},
+		'outcomes': {outcome: outcomes.count(outcome)/len(runs) for outcome in ('death', 'win', 'timeout')},
+		**{metric: distribution([run[metric] for run in runs]) for metric in ('survival_s', 'score', 'level', 'ms_per_tick')},
+		'runs': runs,
+	}
+
+def main():
+	start = time.perf_counter()
+	with multiprocessing.get_context('spawn').Pool(WORKERS, initializer=start_worker) as pool:
+		runs = []
+		for run in pool.imap_unordered(play, range(BASE_SEED, BASE_SEED+RUNS)):
+			runs.append(run)
+			print(f"\r{len(runs)}/{RUNS} runs", end='', flush=True)
+		pool.close() # lets the workers exit on their own, SDL swallows the SIGTERM terminate() would send
+		pool.join()
+	print()
+	result = report(sorted(runs, key=lambda run: run['seed']), time.perf_counter()-start)
+
+	out = Path(option('--out', Path('batch_results') / f"batch_{datetime.now():%Y%m%d_%H%M%S}.json"))
+	out.parent.mkdir(parents=True, exist_ok=True)
+	out.write_text(json.dumps(result, indent='\t'))
+
+	for metric in ('survival_s', 'score', 'level', 'ms_per_tick'):
+		values = result[metric]
+		print(f"{metric:<12} mean {values['mean']:9.2f}   p10 {values['p10']:9.2f}   median {values['median']:9.2f}   p90 {values['p90']:9.2f}")
+	print('outcomes     ' + '   '.join(f"{outcome} {share:.0%}" for outcome, share in result['outcomes'].items()))
+	throughput = result['throughput']
+	print(f"{len(runs)} runs on {WORKERS} workers in {result['meta']['elapsed_s']}s: {throughput['runs_per_minute']:.1f} runs/min, "
+		f"{throughput['runs_per_minute_per_core']:.1f} runs/min/core, {throughput['ticks_per_second']:.0f} ticks/s")
+	print(f"report written to {out}")
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,167 @@
+# benchmark suite: builds scenes with controlled populations, times UPDATE() and DRAW() (drawn to an
+# off-screen surface) across population sizes, saves the results as JSON and compares them to a baseline
+#
+# python bench.py [--quick] [--out FILE] [--save-baseline] [--baseline FILE] [--threshold 0.15] [--no-lod]
+
+import os, sys, gc, time, json, math, platform, subprocess
+import random as r
+from datetime import datetime
+from pathlib import Path
+
+os.environ['AZURE_HEADLESS'] = '1'
+import azure
+import numpy as np
+import pygame
+
+def option(name, default=None):
+	"""Value following a command line flag, or default"""
+	return sys.argv[sys.argv.index(name)+1] if name in sys.argv else default
+
+QUICK = '--quick' in sys.argv
+SIZES = (25, 100, 400) if QUICK else (25, 50, 100, 200, 400, 800)
+TICKS = 20 if QUICK else 40 # timed ticks (and frames) per repeat
+REPEATS = 3 if QUICK else 5 # each repeat starts again from the captured scene
+WARMUP = 3
+BASELINE = Path(option('--baseline', 'bench_baseline.json'))
+THRESHOLD = float(option('--threshold', .15)) # relative slowdown that counts as a regression
+NOISE_FLOOR = .1 # ms, smaller absolute differences are never regressions
+
+#-----------------------------------SCENES-----------------------------------------
+
+ENEMY_KINDS = {'basic': ('Enemy',), 'ranged': ('rangedEnemy',), 'exploder': ('exploderEnemy',),
+	'mixed': ('Enemy', 'rangedEnemy', 'exploderEnemy')}
+
+def spawn_enemies(n, kinds, rng):
+	"""n enemies of the given classes (in turn) spread over the screen, away from the player"""
+	for i in range(n):
+		x, y = rng.uniform(0, azure.WSX), rng.uniform(0, azure.WSY)
+		if abs(x-azure.WSX/2) < 150 and abs(y-azure.WSY/2) < 150: x += 300
+		azure.adversaries.spawn(getattr(azure, kinds[i % len(kinds)]), round(x), round(y))
+
+def spawn_spread(n, rng):
+	"""n mixed enemies spread over five screens each way, most of them far off screen"""
+	for i in range(n):
+		x, y = rng.uniform(-2*azure.WSX, 3*azure.WSX), rng.uniform(-2*azure.WSY, 3*azure.WSY)
+		if abs(x-azure.WSX/2) < 150 and abs(y-azure.WSY/2) < 150: x += 300
+		azure.adversaries.spawn(getattr(azure, ENEMY_KINDS['mixed'][i % 3]), round(x), round(y))
+
+def spawn_bullets(n, owner, rng):
+	for i in range(n):
+		azure.projectiles.spawn(rng.uniform(0, azure.WSX), rng.uniform(0, azure.WSY), rng.uniform(-math.pi, math.pi), owner, 15)
+
+# scene name: builds the scene for a population size n
+SCENES = {name: (lambda kinds: lambda n, rng: spawn_enemies(n, kinds, rng))(kinds) for name, kinds in ENEMY_KINDS.items()}
+SCENES['spread'] = spawn_spread
+SCENES['boss'] = lambda n, rng: (setattr(azure, 'active_boss', azure.Boss(300, 100)), spawn_enemies(n, ENEMY_KINDS['mixed'], rng))
+SCENES['player_bullets'] = lambda n, rng: (spawn_enemies(100, ENEMY_KINDS['basic'], rng), spawn_bullets(n*10, azure.PLAYER_OWNED, rng))
+SCENES['enemy_bullets'] = lambda n, rng: spawn_bullets(n*10, azure.ENEMY_OWNED, rng)
+
+def build_scene(name, n):
+	"""Captured world of a fresh game holding the scene, with an invincible player"""
+	azure.reset_game(seed=n)
+	azure.state = 'play'
+	azure.player.invincibility = 10**9
+	SCENES[name](n, r.Random(f"{name}/{n}"))
+	return azure.capture_world()
+
+#----------------------------------MEASURING---------------------------------------
+
+def time_calls(function, world):
+	"""Per call times (ms) of function, one row for each of REPEATS runs of TICKS calls started from world
+
+	The garbage collector is held off while timing so its pauses don't land on random scenes
+	"""
+	times = np.zeros((REPEATS, TICKS))
+	for repeat in range(REPEATS):
+		azure.restore_world(world)
+		gc.collect()
+		gc.disable()
+		for i in range(WARMUP+TICKS):
+			start = time.perf_counter()
+			function()
+			if i >= WARMUP: times[repeat, i-WARMUP] = (time.perf_counter()-start)*1000
+		gc.enable()
+	return times
+
+def summary(times):
+	"""Best median of the repeats (the least disturbed run) and the p95 over all of them"""
+	return float(np.median(times, axis=1).min()), float(np.percentile(times, 95))
+
+def draw_frame():
+	azure.state = 'play' # no upgrade/death overlay even if the scene got there
+	azure.DRAW()
+
+def measure(name, n):
+	world = build_scene(name, n)
+	entities = len(azure.adversaries) + len(azure.projectiles) + bool(azure.active_boss)
+	update_ms, update_p95 = summary(time_calls(azure.UPDATE, world))
+	draw_ms, draw_p95 = summary(time_calls(draw_frame, world))
+	return {'entities': entities, 'update_ms': update_ms, 'update_p95': update_p95, 'draw_ms': draw_ms, 'draw_p95': draw_p95}
+
+def scaling(sizes, times):
+	"""Growth exponent between neighbouring sizes: ~1 is linear, ~2 is quadratic"""
+	return [round(math.log(t2/t1)/math.log(n2/n1), 2) if t1 > 0 and t2 > 0 else None
+		for (n1, t1), (n2, t2) in zip(zip(sizes, times), zip(sizes[1:], times[1:]))]
+
+def run():
+	azure.assets.require()
+	azure.screen = pygame.Surface(azure.screen.get_size()) # off-screen target for DRAW()
+	azure.render_alpha = 1
+
+	results = {}
+	for name in SCENES:
+		results[name] = {}
+		for n in SIZES:
+			results[name][str(n)] = measure(name, n)
+			row = results[name][str(n)]
+			print(f"{name:<15} n={n:<5} entities={row['entities']:<6} update {row['update_ms']:7.3f} ms (p95 {row['update_p95']:7.3f})"
+				f"   draw {row['draw_ms']:7.3f} ms (p95 {row['draw_p95']:7.3f})")
+		for metric in ('update_ms', 'draw_ms'):
+			results[name][metric.replace('_ms', '_scaling')] = scaling(SIZES, [results[name][str(n)][metric] for n in SIZES])
+		print(f"{'':<15} scaling exponents: update {results[name]['update_scaling']}   draw {results[name]['draw_scaling']}")
+	return results
+
+#---------------------------------BASELINES----------------------------------------
+
+def metadata():
+	try: commit = subprocess.run(('git', 'rev-parse', '--short', 'HEAD'), capture_output=True, text=True).stdout.strip()
+	except OSError: commit = None
+	return {'date': datetime.now().isoformat(timespec='seconds'), 'commit': commit, 'python': platform.python_version(),
+		'pygame': pygame.version.ver, 'numpy': np.__version__, 'machine': platform.platform(),
+		'sizes': SIZES, 'ticks': TICKS, 'repeats': REPEATS}
+
+def compare(results, baseline):
+	"""Lines describing every scene/size/metric more than THRESHOLD slower than the baseline"""
+	regressions = []
+	for name, sizes in results.items():
+		for n, row in sizes.items():
+			old = baseline.get(name, {}).get(n)
+			if not isinstance(row, dict) or not old: continue
+			for metric in ('update_ms', 'draw_ms'):
+				if row[metric] > old[metric]*(1+THRESHOLD) and row[metric]-old[metric] > NOISE_FLOOR:
+					regressions.append(f"{name} n={n} {metric}: {old[metric]:.3f} -> {row[metric]:.3f} ms "
+						f"(+{(row[metric]/old[metric]-1)*100:.0f}%)")
+	return regressions
+
+def main():
+	results = run()
+	report = {'meta': metadata(), 'results': results}
+
+	out = Path(option('--out', Path('bench_results') / f"bench_{datetime.now():%Y%m%d_%H%M%S}.json"))
+	out.parent.mkdir(parents=True, exist_ok=True)
+	out.write_text(json.dumps(report, indent='\t'))
+	print(f"results written to {out}")
+
+	if '--save-baseline' in sys.argv:
+		BASELINE.write_text(json.dumps(report, indent='\t'))
+		print(f"baseline saved to {BASELINE}")
+	elif BASELINE.exists():
+		baseline = json.loads(BASELINE.read_text())
+		regressions = compare(results, baseline['results'])
+		print(f"compared with {BASELINE} ({baseline['meta']['commit']}, {baseline['meta']['date']}), threshold {THRESHOLD:.0%}")
+		for line in regressions: print(f"REGRESSION {line}")
+		if regressions: sys.exit(1)
+		print("no regressions")
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,10 @@
+# the game imports headless with blank images, from the repo root since fonts load from relative paths
+
+import os, sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+os.environ['AZURE_HEADLESS'] = '1'
+os.environ['AZURE_NO_ASSETS'] = '1'
+os.chdir(ROOT)
+sys.path.insert(0, str(ROOT))
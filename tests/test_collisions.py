@@ -0,0 +1,85 @@
+# broadphase lookups and hit resolution agree with checking everything against everything
+
+import random
+
+import pygame
+import azure
+
+
+class Thing:
+	def __init__(self, rect):
+		self.rect = rect
+
+
+def test_grid_query_finds_every_overlap():
+	rng = random.Random(1)
+	things = [Thing(pygame.Rect(rng.randrange(1000), rng.randrange(1000), 30, 30)) for _ in range(300)]
+	grid = azure.SpatialGrid(48)
+	grid.rebuild(things)
+	for thing in things:
+		nearby = grid.query(thing.rect)
+		assert thing in nearby
+		assert all(other in nearby for other in things if thing.rect.colliderect(other.rect))
+		assert len(nearby) < len(things)
+
+
+def reference_hits(targets):
+	"""The per bullet loop the vectorised pass replaced: grid candidates then the boss, first rect holding a corner"""
+	store = azure.projectiles
+	hits = []
+	for i in store.live(azure.PLAYER_OWNED).tolist():
+		x, y = store.pos[i]
+		candidates = azure.enemy_grid.query(pygame.Rect(x-6, y-6, 12, 12))
+		if azure.active_boss: candidates.append(azure.active_boss)
+		corners = store.hitbox_corners([i])[0].tolist()
+		for enemy in candidates:
+			if any(enemy.rect.collidepoint(corner) for corner in corners):
+				hits.append((i, targets.index(enemy)))
+				break
+	return hits
+
+
+def test_bullet_hits_match_per_bullet_loop():
+	azure.reset_game(2)
+	azure.simulate(600, azure.demo_script, reset=False)
+	rng = random.Random(2)
+	for _ in range(60): # a crowd, some of it overlapping
+		azure.adversaries.spawn(rng.choice((azure.Enemy, azure.rangedEnemy)), rng.randrange(600, 1300), rng.randrange(300, 800))
+	azure.assets.require('boss')
+	azure.active_boss = azure.Boss(*azure.player.rect.center)
+	targets = azure.adversaries.live + [azure.active_boss]
+
+	store = azure.projectiles
+	store.clear()
+	for i in range(2000):
+		x, y = rng.choice(targets).rect.center
+		store.spawn(x+rng.uniform(-40, 40), y+rng.uniform(-40, 40), rng.uniform(0, 6.3), azure.PLAYER_OWNED, damage=i)
+	azure.enemy_grid.rebuild(azure.adversaries)
+	expected = reference_hits(targets)
+	assert 0 < len(expected) < len(store)
+
+	azure.resolve_projectile_hits()
+	queued = sorted((int(damage), j) for j, target in enumerate(targets) for damage, _ in target.hits)
+	assert queued == sorted(expected)
+	assert set(store.live(azure.PLAYER_OWNED).tolist()) == set(range(2000)) - {i for i, _ in expected}
+
+
+def test_projectile_store_spawn_compact_and_first_hit():
+	store = azure.ProjectileStore(capacity=4)
+	for i in range(10): # grows past its capacity
+		store.spawn(100+10*i, 100, 0, azure.ENEMY_OWNED if i % 2 else azure.PLAYER_OWNED, damage=i)
+	assert len(store) == 10 and store.live(azure.ENEMY_OWNED).tolist() == [1, 3, 5, 7, 9]
+
+	store.kill(0)
+	store.kill(3)
+	store.pos[5] = (-50, 100) # off screen once moved
+	azure.camera = [0, 0] # culls against the screen at the world origin
+	store.update()
+	assert len(store) == store.count == 7
+	assert store.damage[:7].tolist() == [1, 2, 4, 6, 7, 8, 9] # survivors keep their order
+	assert store.pos[0].tolist() == [110+azure.enemy_projectile_speed, 100]
+
+	rect = pygame.Rect(0, 0, 20, 20)
+	rect.center = store.pos[store.live(azure.ENEMY_OWNED)[1]]
+	assert store.first_hit(rect, azure.ENEMY_OWNED) == store.live(azure.ENEMY_OWNED)[1]
+	assert store.first_hit(pygame.Rect(0, 0, 5, 5), azure.ENEMY_OWNED) is None
@@ -0,0 +1,71 @@
+# enemy bookkeeping: pooling and recycling
+
+import azure
+
+
+def test_pool_sweeps_in_order_and_recycles():
+	pool = azure.EntityPool()
+	enemies = [pool.spawn(azure.Enemy, 10*i, 0) for i in range(4)] + [pool.spawn(azure.rangedEnemy, 50, 0)]
+	enemies[1].delete = enemies[4].delete = True
+	pool.sweep()
+	assert pool.live == [enemies[0], enemies[2], enemies[3]]
+
+	ranged = pool.spawn(azure.rangedEnemy, 300, 200)
+	basic = pool.spawn(azure.Enemy, 400, 200)
+	assert ranged is enemies[4] and basic is enemies[1] # reused, not rebuilt
+	assert basic.rect.topleft == (400, 200) and not basic.delete and basic.health == 25
+	assert ranged.health == 35 and ranged.shoot_cooldown == azure.enemy_shoot_cooldown/2
+	assert pool.spawn(azure.Enemy, 0, 0) not in enemies # free list used up
+
+	pool.clear()
+	assert not pool.live and len(pool.free[azure.Enemy]) == 5
+
+
+def test_far_enemies_update_staggered_and_catch_up(monkeypatch):
+	azure.reset_game(1)
+	azure.adversaries.clear()
+	azure.camera[:] = [0, 0]
+	steps = {}
+	enemies = []
+	for past_edge, count in ((-200, 1), (300, 2), (1000, 4), (2000, 8)): # on screen and one per band, a full phase cycle each
+		for _ in range(count):
+			enemy = azure.adversaries.spawn(azure.Enemy, azure.WSX+past_edge, azure.WSY/2)
+			enemy.update = lambda ticks, uid=enemy.uid: steps.setdefault(uid, []).append(ticks)
+			enemies.append(enemy)
+
+	due = []
+	for tick in range(16):
+		monkeypatch.setattr(azure, 'level_time', tick/azure.TICK_RATE)
+		before = sum(map(len, steps.values()))
+		azure.update_enemies()
+		due.append(sum(map(len, steps.values()))-before)
+
+	interval = dict(zip((e.uid for e in enemies), [1] + [2]*2 + [4]*4 + [8]*8))
+	for uid, ran in steps.items(): # every tick accounted for once the first catch up has run
+		assert ran[1:] == [interval[uid]]*(len(ran)-1) and len(ran) == 16//interval[uid]
+	assert due == [4]*16 # one enemy of every band each tick, never all at once
+
+	monkeypatch.setattr(azure, 'lod', False)
+	steps.clear()
+	azure.update_enemies()
+	assert all(len(ran) == 1 for ran in steps.values()) and len(steps) == len(enemies) # skipped ticks caught up at once
+	assert not any(enemy.lag for enemy in enemies)
+
+
+def test_director_spawns_within_budget_and_cap(monkeypatch):
+	azure.reset_game(1)
+	azure.adversaries.clear()
+	monkeypatch.setattr(azure.rng_spawn, 'random', lambda: 1.0) # no spawns of its own, only the queued ones
+	director = azure.director
+	for i in range(5): director.queue(azure.Enemy, 100*i, 100)
+
+	director.update()
+	assert len(azure.adversaries) == azure.SPAWN_BUDGET and len(director.pending) == 5-azure.SPAWN_BUDGET
+	assert [enemy.rect.topleft for enemy in azure.adversaries] == [(0, 100), (100, 100)] # in queue order
+
+	monkeypatch.setattr(azure, 'SPAWN_CAP', len(azure.adversaries)+1)
+	director.update()
+	director.update()
+	assert len(azure.adversaries) == azure.SPAWN_CAP and len(director.pending) == 2 # held back, not dropped
+	for i in range(10): director.queue(azure.Enemy)
+	assert len(director.pending) == azure.SPAWN_CAP
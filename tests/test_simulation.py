@@ -0,0 +1,46 @@
+# the fixed timestep: a seeded run plays out the same every time, drawing interpolates between ticks
+
+import azure
+
+
+def fingerprint():
+	return (azure.score, azure.level_time, tuple(azure.player.rect), [(type(enemy).__name__, tuple(enemy.rect)) for enemy in azure.adversaries],
+		azure.projectiles.pos[:azure.projectiles.count].tolist())
+
+
+def test_seeded_runs_repeat():
+	runs = []
+	for _ in range(2):
+		azure.reset_game(7)
+		azure.simulate(900, azure.demo_script, reset=False)
+		runs.append((azure.world_digest(), fingerprint()))
+	assert runs[0] == runs[1]
+	assert runs[0][1][3] # enemies showed up
+
+
+def test_render_pos_interpolates_between_ticks():
+	enemy = azure.Enemy(100, 100)
+	enemy.prev = (90, 120)
+	for alpha, expected in ((0, (90, 120)), (.5, (95, 110)), (1, (100, 100))):
+		azure.render_alpha = alpha
+		assert enemy.render_pos() == expected
+	azure.render_alpha = 1
+
+
+def test_quality_steps_with_hysteresis():
+	quality = azure.Quality()
+	def window(frame_ms):
+		for _ in range(azure.QUALITY_WINDOW): quality.update(frame_ms)
+		return quality.level
+
+	budget = azure.QUALITY_BUDGET
+	assert window(budget*.9) == azure.QUALITY_TOP
+	assert [window(budget*1.5) for _ in range(5)] == [2, 1, 0, 0, 0] # one step per window, stops at the bottom
+	assert window(budget*.7) == 0 # between the thresholds nothing moves
+	quality.update(budget*.2)
+	assert quality.level == 0 # only at the end of a window
+	assert window(budget*.2) == 1 and window(budget*.2) == 2
+
+	pinned = azure.Quality(1)
+	for _ in range(azure.QUALITY_WINDOW): pinned.update(budget*3)
+	assert pinned.level == 1
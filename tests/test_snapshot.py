@@ -0,0 +1,67 @@
+# snapshots: a world round trips, pickles naming anything but the world's own globals and worlds of other formats are refused
+
+import os, pickle
+
+import pytest
+
+import azure
+
+
+class Call:
+	# pickles as a call of function(*args)
+	def __init__(self, function, *args):
+		self.reduced = (function, args)
+
+	def __reduce__(self):
+		return self.reduced
+
+
+def test_world_round_trip():
+	azure.reset_game(3)
+	azure.simulate(300, azure.demo_script, reset=False)
+	digest = azure.world_digest()
+	data = azure.capture_world()
+	azure.simulate(300, azure.demo_script, reset=False)
+	azure.restore_world(data)
+	assert azure.world_digest() == digest
+
+
+@pytest.mark.parametrize('function', [os.system, eval, getattr, azure.save_snapshot, azure.pygame.image.save])
+def test_other_globals_rejected(function):
+	with pytest.raises(pickle.UnpicklingError):
+		azure.restore_world(pickle.dumps({'payload': Call(function, 'x')}))
+
+
+def test_numpy_code_runner_rejected(tmp_path):
+	from numpy.testing._private.utils import runstring
+	marker = tmp_path / 'ran'
+	data = pickle.dumps({'payload': Call(runstring, f"open({str(marker)!r}, 'w')", {})})
+	with pytest.raises(pickle.UnpicklingError):
+		azure.restore_world(data)
+	assert not marker.exists()
+
+
+def test_other_versions_rejected(tmp_path):
+	other = azure.WORLD_VERSION+1
+	world = pickle.loads(azure.capture_world())
+	world['version'] = other
+	with pytest.raises(ValueError, match='another version'):
+		azure.restore_world(pickle.dumps(world))
+
+	old = tmp_path / 'old.azs'
+	old.write_bytes(b'AZSS%d' % other + azure.zlib.compress(azure.capture_world()))
+	with pytest.raises(ValueError, match='another version'):
+		azure.load_snapshot(old)
+	old.write_bytes(b'AZRP%d' % other + bytes(16))
+	with pytest.raises(ValueError, match='another version'):
+		azure.Replay.load(old)
+
+
+def test_snapshot_file_round_trip(tmp_path):
+	azure.reset_game(5)
+	azure.simulate(120, azure.demo_script, reset=False)
+	digest = azure.world_digest()
+	azure.save_snapshot(tmp_path / 'run.azs')
+	azure.reset_game()
+	azure.restore_world(azure.load_snapshot(tmp_path / 'run.azs'))
+	assert azure.world_digest() == digest